@@ -6,15 +6,26 @@ import json
 import logging.config
 
 from .account import Account, Suite
+from .batch import Batch, Submission
+from .cache import ResponseCache, ReportCache, MetadataCache
 from .elements import Value, Element, Segment
+from .polling import Backoff, AdaptivePolling
 from .query import Query
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
 from .reports import InvalidReportError, Report, DataWarehouseReport
+from .validation import ValidationError
 from .version import __version__
 from . import utils
+from . import batch
+from . import scheduler
 
 
-def authenticate(username, secret=None, endpoint=Account.DEFAULT_ENDPOINT, prefix='', suffix=''):
-    """ Authenticate to the Adobe API using WSSE """
+def authenticate(username, secret=None, endpoint=Account.DEFAULT_ENDPOINT, prefix='', suffix='', **kwargs):
+    """ Authenticate to the Adobe API using WSSE
+
+    Any additional keyword arguments are passed on to `Account`
+    """
     #setup logging
     setup_logging()
     # if no secret is specified, we will assume that instead
@@ -27,18 +38,85 @@ def authenticate(username, secret=None, endpoint=Account.DEFAULT_ENDPOINT, prefi
         username = source[key_to_username]
         secret = source[key_to_secret]
 
-    return Account(username, secret, endpoint)
+    return Account(username, secret, endpoint, **kwargs)
 
 
-def queue(queries):
+def queue(queries, max_workers=4):
+    """
+    `omniture.queue` will submit a number of reports to the Queue,
+    `max_workers` at a time, and return the queries, now with their
+    report IDs, as a list or as a dictionary if it was given one.
+
+    If a report can't be queued, its error is raised once the
+    others have been queued. Use `omniture.submit` to get every error
+    back instead.
+    """
+    queued = submit(queries, max_workers)
+    queued.raise_for_failures()
     if isinstance(queries, dict):
-        queries = queries.values()
+        return dict((submission.key, submission.query) for submission in queued)
+    return [submission.query for submission in queued]
+
+
+def submit(queries, max_workers=4, max_pending=None):
+    """
+    `omniture.submit` will submit a number of reports to the Queue,
+    `max_workers` at a time, and return a `Batch` with the report ID,
+    the time it took to queue and any error of each report.
+
+        batch = omniture.submit(queries, max_workers=16)
+        print batch.report_ids, batch.latency()
+        batch.raise_for_failures()
+
+    Queries can be a list, a dictionary or any iterable, including a
+    generator: no more than `max_pending` queries are taken from it
+    before they have been queued.
+    """
+    return batch.submit(queries, max_workers, max_pending)
+
+
+def _items(queries):
+    """ Pairs of (key, query) for a list or a dictionary of queries """
+    if isinstance(queries, list):
+        return list(enumerate(queries))
+    elif isinstance(queries, dict):
+        return list(queries.items())
+    else:
+        message = "Queries should be a list or a dictionary, received: {}".format(
+            queries.__class__)
+        raise ValueError(message)
+
 
-    for query in queries:
-        query.queue()
+def as_completed(queries, heartbeat=None, interval=1, max_workers=4):
+    """
+    `omniture.as_completed` will queue a number of reports and yield
+    `(key, report)` pairs as soon as each report is ready, where the key
+    is the position of the query in a list or its key in a dictionary.
 
+        for key, report in omniture.as_completed(queries):
+            print key, report.data
 
-def sync(queries, heartbeat=None, interval=1):
+    All outstanding reports are polled concurrently. `max_workers` caps
+    the number of requests in flight at any one time.
+    """
+    items = _items(queries)
+    queued = submit(queries, max_workers)
+
+    with scheduler.Scheduler(max_workers, heartbeat, interval) as pool:
+        futures = []
+        for key, query in items:
+            if queued[key].ok:
+                futures.append(pool.submit(query, key))
+            else:
+                # don't queue a report that failed once all over again
+                future = scheduler.Future(query, key)
+                future.set_exception(queued[key].exc_info)
+                futures.append(future)
+        for future in scheduler.as_completed(futures):
+            yield future.key, future.result()
+
+
+def sync(queries, heartbeat=None, interval=1, max_workers=4):
     """
     `omniture.sync` will queue a number of reports and then
     block until the results are all ready.
@@ -51,19 +129,18 @@ def sync(queries, heartbeat=None, interval=1):
         omniture.queue(query)
         omniture.sync(query)
 
-    The interval will operate under an exponetial decay until it reaches 5 minutes. At which point it will ping every 5 minutes
-    """
+    The interval will operate under an exponetial decay until it reaches 30 seconds.
 
-    queue(queries)
+    All reports are polled concurrently, with at most `max_workers`
+    requests in flight at any one time.
+    """
+    items = _items(queries)
+    results = dict(as_completed(queries, heartbeat, interval, max_workers))
 
     if isinstance(queries, list):
-        return [query.sync(heartbeat, interval) for query in queries]
-    elif isinstance(queries, dict):
-        return {key: query.sync(heartbeat, interval) for key, query in queries.items()}
+        return [results[key] for key, query in items]
     else:
-        message = "Queries should be a list or a dictionary, received: {}".format(
-            queries.__class__)
-        raise ValueError(message)
+        return results
 
 
 def setup_logging(default_path='logging.json', default_level=logging.INFO, env_key='LOG_CFG'):
@@ -6,73 +6,214 @@ import sha
 import json
 from datetime import datetime, date
 import logging
+import threading
+import time
 import uuid
-import hashlib
-import base64
-import os
+from multiprocessing.pool import ThreadPool
 
+from .cache import ResponseCache, ReportCache, default_metadata_cache
+from . import cache as caches
 from .elements import Value, Element, Segment
+from .polling import Backoff, AdaptivePolling
 from .query import Query
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
 from . import reports
+from . import scheduler as schedulers
 from . import utils
+from . import validation
 
 
 class Account(object):
     """ A wrapper for the Adobe Analytics API. Allows you to query the reporting API """
     DEFAULT_ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
-
-    def __init__(self, username, secret, endpoint=DEFAULT_ENDPOINT, cache=False, cache_key=None):
-        """Authentication to make requests."""
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, username, secret, endpoint=DEFAULT_ENDPOINT, cache=False, cache_key=None,
+                 report_cache=None, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True,
+                 polling=None, rate_limit=None, retry=None, timeout=None, lazy=False, snapshot=None,
+                 metadata_cache=None):
+        """Authentication to make requests.
+
+        * cache -- cache metadata responses on disk. Either True for the
+            default location, a directory or a ResponseCache
+        * cache_key -- namespace for cached responses, defaults to today's
+            date so metadata is refreshed daily
+        * report_cache -- reuse finished reports over closed date ranges.
+            Either True for the default location, a directory or a ReportCache
+        * pool_connections -- number of hosts to keep a connection pool for
+        * pool_maxsize -- maximum number of connections kept alive per host
+        * pool_block -- block when every connection to a host is in use
+            instead of opening a throwaway connection
+        * keep_alive -- reuse connections between requests
+        * polling -- how long to wait between checks on a queued report.
+            Defaults to backing off. True learns from how long earlier
+            reports took, as does a path to keep those timings in
+        * rate_limit -- requests per second to stay under, either for
+            every request or as a dictionary of limits per API method,
+            or a RateLimiter
+        * retry -- how often to retry requests that fail for transient
+            reasons. A number of retries, False to never retry, or a
+            RetryPolicy. Defaults to three retries
+        * timeout -- seconds to wait for Adobe to respond before a
+            request is considered failed
+        * lazy -- only fetch the list of report suites once it is needed
+        * snapshot -- load the report suites and their metadata from a
+            snapshot made with `snapshot()` or `save_snapshot()`, either a
+            path or the snapshot itself, instead of from the API
+        * metadata_cache -- the MetadataCache that keeps the metrics,
+            elements and segments of report suites in memory. Defaults to
+            a cache shared by every account in the process
+        """
         self.log = logging.getLogger(__name__)
         self.username = username
         self.secret = secret
         self.endpoint = endpoint
-        #Allow someone to set a custom cache key
+        self.timeout = timeout
+        self.session = self._build_session(pool_connections, pool_maxsize,
+                                           pool_block, keep_alive)
+        #cache can be True for the default location, a directory or a ResponseCache
+        if cache is True:
+            cache = ResponseCache()
+        elif isinstance(cache, basestring):
+            cache = ResponseCache(cache)
         self.cache = cache
+        if report_cache is True:
+            report_cache = ReportCache()
+        elif isinstance(report_cache, basestring):
+            report_cache = ReportCache(report_cache)
+        self.report_cache = report_cache
+        if polling is None:
+            polling = Backoff()
+        elif polling is True:
+            polling = AdaptivePolling()
+        elif isinstance(polling, basestring):
+            polling = AdaptivePolling(polling)
+        self.polling = polling
+        if rate_limit is None or isinstance(rate_limit, RateLimiter):
+            self.rate_limit = rate_limit
+        elif isinstance(rate_limit, dict):
+            self.rate_limit = RateLimiter(rate_limit)
+        else:
+            self.rate_limit = RateLimiter(default=rate_limit)
+        if retry is None:
+            retry = RetryPolicy()
+        elif retry is False:
+            retry = RetryPolicy(retries=0)
+        elif isinstance(retry, (int, long)):
+            retry = RetryPolicy(retries=retry)
+        self.retry = retry
+        #Allow someone to set a custom cache key
         if cache_key:
             self.cache_key = cache_key
         else:
             self.cache_key = date.today().isoformat()
-        if self.cache:
-            data = self.request_cached('Company', 'GetReportSuites')['report_suites']
-        else:
-            data = self.request('Company', 'GetReportSuites')['report_suites']
-        suites = [Suite(suite['site_title'], suite['rsid'], self) for suite in data]
-        self.suites = utils.AddressableList(suites)
-        #define page number as 1, will be incremented in request method. Used for warehouse requests
-        self.page_num = 1
+        self.metadata_cache = metadata_cache or default_metadata_cache()
+        #metadata cache entries of this account are kept apart from other accounts'
+        self.namespace = username + '@' + endpoint
+        self._suites = None
+        self._suites_lock = threading.Lock()
+        self._shared_lock = threading.Lock()
+        if snapshot is not None:
+            self.load_snapshot(snapshot)
+        elif not lazy:
+            self.suites
 
-    def request_cached(self, api, method, query={}, cache_key=None):
-        if cache_key:
-            key = cache_key
+    @property
+    def suites(self):
+        """ The report suites of the company, fetched the first time they're needed """
+        if self._suites is None:
+            with self._suites_lock:
+                if self._suites is None:
+                    if self.cache:
+                        data = self.request_cached('Company', 'GetReportSuites')['report_suites']
+                    else:
+                        data = self.request('Company', 'GetReportSuites')['report_suites']
+                    suites = [Suite(suite['site_title'], suite['rsid'], self) for suite in data]
+                    self._suites = utils.AddressableList(suites)
+        return self._suites
+
+    def prefetch(self, suites=None, categories=('metrics', 'elements', 'segments'), max_workers=8):
+        """
+        Fetch the metadata of a number of report suites (all of them by
+        default) concurrently, rather than one request at a time as each
+        suite's metrics, elements and segments are first used.
+        """
+        if suites is None:
+            suites = list(self.suites)
         else:
-            key = self.cache_key
-
-        #Generate a shortened hash of the query string so that method don't collide
-        query_hash = base64.urlsafe_b64encode(hashlib.md5(query).digest())
+            suites = [suite if isinstance(suite, Suite) else self.suites[suite] for suite in suites]
 
+        jobs = [(suite, category) for suite in suites for category in categories]
+        pool = ThreadPool(max_workers)
         try:
-            with open(self.file_path+'/data_'+api+'_'+method+'_'+query_hash+'_'+key+'.txt') as fp:
-                for line in fp:
-                    if line:
-                        data = ast.literal_eval(line)
+            pool.map(lambda job: job[0].metadata(job[1]), jobs)
+        finally:
+            pool.terminate()
+        return self
 
-        except IOError as e:
-            data = self.request(api, method, query)
+    def snapshot(self):
+        """
+        The report suites and whatever metadata has been fetched for them,
+        as a dictionary that can be serialized to JSON and passed back to
+        `Account(snapshot=...)` to skip fetching it all again.
+        """
+        return {
+            'version': self.SNAPSHOT_VERSION,
+            'created': time.time(),
+            'endpoint': self.endpoint,
+            'suites': [{
+                'rsid': suite.id,
+                'site_title': suite.title,
+                'metadata': suite.cached_metadata(),
+            } for suite in self.suites],
+        }
 
-            # Capture all other old text files
-            #TODO decide if the query should be included in the file list to be cleared out when the cache key changes
-            filelist = [f for f in os.listdir(self.file_path) if f.startswith('data_'+api+'_'+method)]
+    def invalidate(self, suite=None, category=None):
+        """
+        Forget the cached metadata of a report suite and/or a category
+        (`metrics`, `elements` or `segments`), or all of it, so that it's
+        fetched again the next time it is used.
+        """
+        if suite is None:
+            suites = self.suites
+        else:
+            suites = [suite if isinstance(suite, Suite) else self.suites[suite]]
+        for suite in suites:
+            suite.invalidate(category)
+
+    def save_snapshot(self, path):
+        utils.atomic_write(path, json.dumps(self.snapshot()))
+
+    def load_snapshot(self, snapshot):
+        """ Replace the report suites and their metadata with those from a snapshot """
+        if isinstance(snapshot, basestring):
+            with open(snapshot, 'rb') as fp:
+                snapshot = json.load(fp)
+        if snapshot.get('version') != self.SNAPSHOT_VERSION:
+            raise ValueError("Can't load a snapshot of version {}, expected version {}".format(
+                snapshot.get('version'), self.SNAPSHOT_VERSION))
+
+        suites = [Suite(suite['site_title'], suite['rsid'], self, metadata=suite['metadata'])
+                  for suite in snapshot['suites']]
+        self._suites = utils.AddressableList(suites)
 
-            # Delete them
-            for f in filelist:
-                os.remove(self.file_path+'/'+f)
+    def request_cached(self, api, method, query={}, cache_key=None):
+        """
+        Make a request to the Adobe APIs, reusing a previous response for the
+        same api, method, query and cache key if the cache has one.
 
-            # Build the new data
-            the_file = open(self.file_path+'/data_'+api+'_'+method+'_'+query_hash+'_'+key+'.txt', 'w')
-            the_file.write(str(data))
-            the_file.close()
+        Makes a regular request when caching is turned off.
+        """
+        if not self.cache:
+            return self.request(api, method, query)
 
+        key = self.cache.key(api, method, query, cache_key or self.cache_key)
+        data = self.cache.get(key)
+        if data is None:
+            data = self.request(api, method, query)
+            self.cache.set(key, data)
+        return data
 
     def request(self, api, method, query={}):
         """
@@ -94,10 +235,6 @@ class Account(object):
             import httplib as http_client
         http_client.HTTPConnection.debuglevel = 1
         '''
-        if method == 'Get' and 'reportID' in query and 'page' not in query:
-            query['format'] = 'csv'
-            query['page'] = self.page_num
-
         self.log.info("Request: %s.%s  Parameters: %s", api, method, query)
         '''
         HTTP REQUEST Debugging
@@ -108,12 +245,7 @@ class Account(object):
         requests_log.setLevel(logging.DEBUG)
         requests_log.propagate = True
         '''
-        response = requests.post(
-            self.endpoint,
-            params={'method': api + '.' + method},
-            data=json.dumps(query),
-            headers=self._build_token()
-            )
+        response = self.retry.call(api, method, lambda: self._post(api, method, query))
         self.log.debug("Response for %s.%s:%s", api, method, response.text)
 
         if method == 'Get' and 'format' in query:
@@ -128,11 +260,10 @@ class Account(object):
                 elif dict_Value['error'] == 'no_warehouse_data':
                     return response
                 elif dict_Value['error'] != None:
-                    raise reports.InvalidReportError(response.content)
+                    raise reports.InvalidReportError(dict_Value)
                 else:
                     return response
             else:
-                self.page_num = self.page_num + 1
                 return response
         else:
             json_response = response.json()
@@ -149,6 +280,27 @@ class Account(object):
                 return json_response
 
 
+    def _post(self, api, method, query):
+        """ Send a single request, with a fresh token, once the rate limit allows """
+        if self.rate_limit:
+            self.rate_limit.acquire(api, method)
+        return self.session.post(
+            self.endpoint,
+            params={'method': api + '.' + method},
+            data=json.dumps(query),
+            headers=self._build_token(),
+            timeout=self.timeout
+            )
+
+    def request_async(self, api, method, query={}, scheduler=None):
+        """
+        Make a request to the Adobe APIs without blocking.
+
+        Takes the same arguments as `request` and returns a Future of the response.
+        """
+        scheduler = scheduler or schedulers.default_scheduler()
+        return scheduler.call(self.request, api, method, query)
+
     def jsonReport(self, reportJSON):
         """Generates a Report from the JSON (including selecting the report suite)"""
         if type(reportJSON) == str:
@@ -157,6 +309,39 @@ class Account(object):
         suite = self.suites[suiteID]
         return suite.jsonReport(reportJSON)
 
+    def compile(self, descriptions, max_workers=8):
+        """
+        Turn a list or a dictionary of report descriptions, like those
+        `jsonReport` takes, into queries that are ready to be queued.
+
+        The metadata of every suite involved is fetched up front and all
+        references are checked in one pass. If any description is invalid,
+        a ValidationError lists the problems with each of them.
+        """
+        return validation.compile_reports(self, descriptions, max_workers)
+
+
+    def close(self):
+        """ Close every pooled connection held by the account """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _build_session(self, pool_connections, pool_maxsize, pool_block, keep_alive):
+        """ Build the persistent session that every API call goes through """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                pool_maxsize=pool_maxsize,
+                                                pool_block=pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
 
     def _serialize_header(self, properties):
         header = []
@@ -198,48 +383,139 @@ class Account(object):
 
 class Suite(Value):
     """Lets you query a specific report suite. """
+    __slots__ = ('account', 'pinned')
+    log = logging.getLogger(__name__)
+    #the request that fetches each kind of metadata
+    METADATA = {
+        'metrics': ('Report', 'GetMetrics', {}),
+        'elements': ('Report', 'GetElements', {'reportType':'warehouse'}),
+        'segments': ('Segments', 'Get', {"accessLevel":"shared"}),
+    }
+
     def request(self, api, method, query={}):
+        return self.account.request(api, method, self._build_query(method, query))
+
+    def request_cached(self, api, method, query={}):
+        return self.account.request_cached(api, method, self._build_query(method, query))
+
+    def _build_query(self, method, query):
         raw_query = {}
         raw_query.update(query)
         if method == 'GetMetrics' or method == 'GetElements':
             raw_query['reportSuiteID'] = self.id
+        return raw_query
 
-        return self.account.request(api, method, raw_query)
-
-    def __init__(self, title, id, account, cache=False):
-        self.log = logging.getLogger(__name__)
+    def __init__(self, title, id, account, cache=False, metadata=None):
         super(Suite, self).__init__(title, id, account)
         self.account = account
+        #metadata loaded from a snapshot is kept on the suite, where it doesn't expire
+        self.pinned = {}
+        for category, data in (metadata or {}).items():
+            data = self.account.metadata_cache.definitions.intern(data)
+            self.pinned[category] = {'raw': data, 'values': None}
+
+    def _cache_key(self, category):
+        return (self.account.namespace, self.id, category)
+
+    def _shared(self, category):
+        """ Whether the request for a category is the same for every suite of the account """
+        api, method, query = self.METADATA[category]
+        return 'reportSuiteID' not in self._build_query(method, query)
+
+    def _fetch(self, category):
+        api, method, query = self.METADATA[category]
+        if self.account.cache:
+            data = self.request_cached(api, method, query)
+        else:
+            data = self.request(api, method, query)
+        return self.account.metadata_cache.definitions.intern(data)
+
+    def _fetch_shared(self, category):
+        """ Fetch metadata that doesn't depend on the suite once for the whole account """
+        key = (self.account.namespace, None, category)
+        with self.account._shared_lock:
+            data = self.account.metadata_cache.get(key)
+            if data is None:
+                data = self._fetch(category)
+                self.account.metadata_cache.set(key, data)
+        return data
+
+    def _entry(self, category):
+        """ The metadata cache entry for a category, fetching it if it's missing or expired """
+        if category in self.pinned:
+            return self.pinned[category]
+        key = self._cache_key(category)
+        entry = self.account.metadata_cache.get(key)
+        if entry is None:
+            if self._shared(category):
+                data = self._fetch_shared(category)
+            else:
+                data = self._fetch(category)
+            entry = {'raw': data, 'values': None}
+            self.account.metadata_cache.set(key, entry)
+        return entry
+
+    def _values(self, category, cls):
+        entry = self._entry(category)
+        if entry['values'] is None:
+            entry['values'] = cls.list(category, entry['raw'], self, 'name', 'id')
+        return entry['values']
+
+    def metadata(self, category):
+        """ The raw API response for `metrics`, `elements` or `segments` """
+        return self._entry(category)['raw']
+
+    def cached_metadata(self):
+        """ The raw API responses that were loaded from a snapshot or are in the metadata cache, by category """
+        metadata = {}
+        for category in self.METADATA:
+            entry = self.pinned.get(category) or self.account.metadata_cache.get(self._cache_key(category))
+            if entry is not None:
+                metadata[category] = entry['raw']
+        return metadata
+
+    def diff(self, other, category):
+        """
+        How the `metrics`, `elements` or `segments` of another suite differ
+        from those of this one: a MetadataDiff of the definitions that were
+        added, removed and changed.
+
+        >>> suite.diff(analytics.suites['omniture.mobile'], 'metrics').added
+        """
+        return caches.diff(self.metadata(category), other.metadata(category))
+
+    def invalidate(self, category=None):
+        """
+        Forget the metadata of this suite, or of one category, here and in the response cache.
+
+        Segments are the same for every suite of an account, so invalidating
+        them for one suite invalidates them for all.
+        """
+        self.account.metadata_cache.invalidate(self.account.namespace, self.id, category)
+        for name in ([category] if category else self.METADATA):
+            self.pinned.pop(name, None)
+            if self._shared(name):
+                self.account.metadata_cache.invalidate(self.account.namespace, None, name)
+        if self.account.cache:
+            for name in ([category] if category else self.METADATA):
+                api, method, query = self.METADATA[name]
+                self.account.cache.delete(self.account.cache.key(
+                    api, method, self._build_query(method, query), self.account.cache_key))
 
     @property
-    @utils.memoize
     def metrics(self):
         """ Return the list of valid metricsfor the current report suite"""
-        if self.account.cache:
-            data = self.request_cache('Report', 'GetMetrics')
-        else:
-            data = self.request('Report', 'GetMetrics')
-        return Value.list('metrics', data, self, 'name', 'id')
+        return self._values('metrics', Value)
 
     @property
-    @utils.memoize
     def elements(self):
         """ Return the list of valid elementsfor the current report suite """
-        if self.account.cache:
-            data = self.request_cached('Report', 'GetElements', {'reportType':'warehouse'})
-        else:
-            data = self.request('Report', 'GetElements', {'reportType':'warehouse'})
-        return Element.list('elements', data, self, 'name', 'id')
+        return self._values('elements', Element)
 
     @property
-    @utils.memoize
     def segments(self):
         """ Return the list of valid segments for the current report suite """
-        if self.account.cache:
-            data = self.request_cached('Segments', 'Get',{"accessLevel":"shared"})
-        else:
-            data = self.request('Segments', 'Get',{"accessLevel":"shared"})
-        return Segment.list('segments', data, self, 'name', 'id',)
+        return self._values('segments', Segment)
 
     @property
     def report(self):
@@ -304,6 +580,14 @@ class Suite(Value):
             q = q.set('elementDataEncoding',reportJSON['elementDataEncoding'])
         return q
 
+    def compile(self, description):
+        """
+        Turn a report description into a query that is ready to be queued,
+        checking all of its metrics, elements and segments at once.
+        Raises a ValidationError with every problem that was found.
+        """
+        return validation.compile_report(self, description)
+
     def _repr_html_(self):
         """ Format in HTML for iPython Users """
         return "<td>{0}</td><td>{1}</td>".format(self.id, self.title)
@@ -0,0 +1,142 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import logging
+import sys
+import threading
+import time
+
+from . import scheduler as schedulers
+
+
+class Submission(object):
+    """ The outcome of queueing a single report """
+    def __init__(self, key, query):
+        self.key = key
+        self.query = query
+        self.report_id = None
+        self.latency = None
+        self.exc_info = None
+
+    @property
+    def ok(self):
+        return self.exc_info is None
+
+    @property
+    def error(self):
+        """ The exception raised while queueing the report, if any """
+        if self.exc_info:
+            return self.exc_info[1]
+        return None
+
+    def __repr__(self):
+        if self.error:
+            state = 'failed: {!r}'.format(self.error)
+        else:
+            state = self.report_id
+        return "<omniture.Submission {0} ({1})>".format(self.key, state)
+
+
+class Batch(object):
+    """
+    The reports queued by `omniture.submit`, with their report IDs, how
+    long it took to queue each of them and what went wrong if it failed.
+
+    Iterate over it for every Submission, or look one up by the key of
+    its query: its position in a list or its key in a dictionary.
+    """
+    def __init__(self, submissions, elapsed=None):
+        self.submissions = submissions
+        self.elapsed = elapsed
+        self._keys = dict((submission.key, submission) for submission in submissions)
+
+    @property
+    def report_ids(self):
+        """ Report IDs by key, for the reports that were queued """
+        return dict((submission.key, submission.report_id) for submission in self
+                    if submission.report_id is not None)
+
+    @property
+    def failures(self):
+        return [submission for submission in self if not submission.ok]
+
+    def latency(self):
+        """ Mean and maximum seconds it took to queue a report """
+        latencies = [submission.latency for submission in self if submission.latency is not None]
+        if not latencies:
+            return {'count': 0, 'mean': None, 'max': None}
+        return {
+            'count': len(latencies),
+            'mean': sum(latencies) / len(latencies),
+            'max': max(latencies),
+        }
+
+    def raise_for_failures(self):
+        """ Raise the error of the first report that couldn't be queued, if any """
+        for submission in self.failures:
+            exc_type, exc_value, traceback = submission.exc_info
+            raise exc_type, exc_value, traceback
+
+    def __getitem__(self, key):
+        return self._keys[key]
+
+    def __iter__(self):
+        return iter(self.submissions)
+
+    def __len__(self):
+        return len(self.submissions)
+
+    def __repr__(self):
+        return "<omniture.Batch {0} queued, {1} failed>".format(
+            len(self) - len(self.failures), len(self.failures))
+
+
+def submit(queries, max_workers=4, max_pending=None):
+    """
+    Queue any number of queries from a pool of `max_workers` threads.
+
+    At most `max_pending` queries (twice the number of workers by default)
+    are waiting to be queued at any time, so a generator of queries is only
+    consumed as fast as the reports can be queued. Errors don't stop the
+    batch, they are kept on the Submission of the report that failed.
+    """
+    log = logging.getLogger(__name__)
+    if isinstance(queries, dict):
+        items = queries.iteritems()
+    else:
+        items = enumerate(queries)
+
+    pending = threading.BoundedSemaphore(max_pending or max_workers * 2)
+    submissions = []
+    futures = []
+    start = time.time()
+    pool = schedulers.Scheduler(max_workers)
+    try:
+        for key, query in items:
+            pending.acquire()
+            submission = Submission(key, query)
+            submissions.append(submission)
+            future = pool.call(_queue, submission)
+            future.add_done_callback(lambda future: pending.release())
+            futures.append(future)
+        for future in futures:
+            future.result()
+    finally:
+        pool.shutdown()
+
+    batch = Batch(submissions, time.time() - start)
+    log.info("Queued %s reports in %.1f seconds, %s failed",
+             len(batch), batch.elapsed, len(batch.failures))
+    return batch
+
+
+def _queue(submission):
+    start = time.time()
+    try:
+        submission.query.queue()
+        submission.report_id = submission.query.id
+    except Exception as error:
+        logging.getLogger(__name__).warning("Couldn't queue %s: %r", submission.key, error)
+        submission.exc_info = sys.exc_info()
+    finally:
+        submission.latency = time.time() - start
@@ -0,0 +1,335 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import collections
+import datetime
+import errno
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from . import utils
+
+
+class ResponseCache(object):
+    """
+    Persistent cache of API responses on disk.
+
+    Every entry lives in its own file, named after a hash of its key, and is
+    written atomically so several processes can share the same directory.
+    Entries expire `ttl` seconds after they were written. Once the cache grows
+    beyond `max_size` bytes the least recently used entries are evicted.
+
+    >>> cache = ResponseCache('/tmp/omniture', ttl=3600)
+    >>> analytics = omniture.authenticate(os.environ, cache=cache)
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.omniture', 'cache')
+
+    def __init__(self, path=DEFAULT_PATH, ttl=24 * 60 * 60, max_size=100 * 1024 * 1024):
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @staticmethod
+    def key(*parts):
+        """ Canonical hash of any JSON serializable values """
+        canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(canonical).hexdigest()
+
+    def get(self, key, default=None):
+        """ Return the cached value for a key, or default if it's missing or expired """
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as fp:
+                entry = json.load(fp)
+        except (IOError, ValueError):
+            return default
+
+        if self.ttl is not None and time.time() - entry['created'] > self.ttl:
+            self.log.debug("Cache entry %s expired", key)
+            self._remove(filename)
+            return default
+
+        # the modification time doubles as the last access time for eviction
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        self.log.debug("Cache hit for %s", key)
+        return entry['data']
+
+    def set(self, key, data):
+        """ Store a JSON serializable value """
+        entry = json.dumps({'created': time.time(), 'data': data})
+        utils.atomic_write(self._filename(key), entry)
+        self.evict()
+
+    def delete(self, key):
+        self._remove(self._filename(key))
+
+    def clear(self):
+        """ Remove every entry """
+        with utils.FileLock(self._lockfile()):
+            for name in self._entries():
+                self._remove(os.path.join(self.path, name))
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits in max_size """
+        if self.max_size is None:
+            return
+
+        with utils.FileLock(self._lockfile()):
+            entries = []
+            for name in self._entries():
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for mtime, size, name in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                self.log.debug("Evicting cache entry %s", name)
+                self._remove(os.path.join(self.path, name))
+                total -= size
+
+    def _entries(self):
+        return [name for name in os.listdir(self.path) if name.endswith('.json')]
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def _lockfile(self):
+        return os.path.join(self.path, '.lock')
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+class ReportCache(ResponseCache):
+    """
+    Cache of finished reports, keyed on their report description.
+
+    Running the exact same report description again returns the cached
+    report without queueing anything. Only reports over closed date ranges
+    are cached: reports that ask for `currentData`, have no end date or end
+    less than `lag` days ago are always fetched from the API. Subclass and
+    override `cacheable` for a different policy.
+
+    >>> analytics = omniture.authenticate(os.environ, report_cache=ReportCache(lag=2))
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.omniture', 'reports')
+
+    def __init__(self, path=DEFAULT_PATH, ttl=None, max_size=1024 * 1024 * 1024, lag=1):
+        super(ReportCache, self).__init__(path, ttl, max_size)
+        self.lag = lag
+
+    def cacheable(self, description):
+        """ Whether the data for a report description is final """
+        if description.get('currentData'):
+            return False
+
+        end = description.get('dateTo') or description.get('date')
+        if not end:
+            return False
+
+        try:
+            end = utils.date(end)
+        except ValueError:
+            return False
+        return (datetime.date.today() - end).days >= self.lag
+
+    def get_report(self, description):
+        """ The raw response for a report description, or None """
+        if not self.cacheable(description):
+            return None
+        return self.get(self.key(description))
+
+    def set_report(self, description, response):
+        if self.cacheable(description):
+            self.set(self.key(description), response)
+
+
+class Definition(dict):
+    """
+    The definition of a metric, element or segment as the API returned it,
+    shared by every report suite that has an identical one. Definitions
+    can't be changed, since a change would show up in all of those suites.
+    """
+    __slots__ = ('__weakref__',)
+
+    def _frozen(self, *vargs, **kwargs):
+        raise TypeError("Definitions are shared between report suites and can't be changed")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _frozen
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return json.loads(json.dumps(self))
+
+    def __reduce__(self):
+        return (Definition, (dict(self),))
+
+
+class DefinitionPool(object):
+    """
+    Keeps one shared, frozen copy of every distinct metadata definition.
+
+    Most report suites of a company have the same metrics and elements,
+    so interning their definitions means a thousand suites cost little more
+    memory than one, and telling whether two definitions are the same is a
+    matter of comparing identities. Definitions that no suite uses any more
+    are dropped from the pool.
+    """
+    def __init__(self):
+        self.definitions = weakref.WeakValueDictionary()
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def intern(self, obj):
+        """ Freeze a parsed API response, replacing every dictionary in it by its shared copy """
+        if isinstance(obj, dict):
+            definition = Definition((key, self.intern(value)) for key, value in obj.items())
+            key = json.dumps(definition, sort_keys=True)
+            with self.lock:
+                shared = self.definitions.get(key)
+                if shared is None:
+                    self.definitions[key] = shared = definition
+                    self.counters['distinct'] += 1
+                else:
+                    self.counters['shared'] += 1
+            return shared
+        elif isinstance(obj, (list, tuple)):
+            return tuple(self.intern(item) for item in obj)
+        else:
+            return obj
+
+    def stats(self):
+        """ How many definitions were new and how many were shared, and how many are in use """
+        with self.lock:
+            stats = dict.fromkeys(['distinct', 'shared'], 0)
+            stats.update(self.counters)
+            stats['definitions'] = len(self.definitions)
+        return stats
+
+
+MetadataDiff = collections.namedtuple('MetadataDiff', ['added', 'removed', 'changed'])
+
+
+def diff(old, new):
+    """
+    Compare two lists of definitions by id. Returns the definitions that
+    are only in `new`, those only in `old` and (old, new) pairs of those
+    that are defined differently.
+    """
+    old_ids = collections.OrderedDict((definition['id'], definition) for definition in old)
+    new_ids = collections.OrderedDict((definition['id'], definition) for definition in new)
+    added = [definition for id, definition in new_ids.items() if id not in old_ids]
+    removed = [definition for id, definition in old_ids.items() if id not in new_ids]
+    changed = []
+    for id, definition in old_ids.items():
+        other = new_ids.get(id)
+        # interned definitions are the same object when they are the same
+        if other is not None and other is not definition and other != definition:
+            changed.append((definition, other))
+    return MetadataDiff(added, removed, changed)
+
+
+class MetadataCache(object):
+    """
+    In-memory cache of the metrics, elements and segments of report suites.
+
+    Entries are keyed on (account, suite, category). They expire `ttl`
+    seconds after they were stored, an hour by default, so metadata that
+    admins add shows up in long running processes. With a `ttl` of None
+    they are kept for good. Once there are more than `max_size` entries
+    the least recently used ones are dropped. Unless an account is given
+    a cache of its own, every account shares the same cache.
+
+    Identical definitions are stored once, in `definitions`, however many
+    suites and accounts have them.
+
+    >>> analytics = omniture.authenticate(os.environ, metadata_cache=MetadataCache(ttl=600))
+    >>> analytics.metadata_cache.stats()
+    """
+    def __init__(self, ttl=60 * 60, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+        self.definitions = DefinitionPool()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.counters['misses'] += 1
+                return default
+            created, value = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                self.counters['misses'] += 1
+                self.counters['expired'] += 1
+                return default
+            # move to the end of the line, as the most recently used
+            self.entries[key] = entry
+            self.counters['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time(), value)
+            while self.max_size is not None and len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def invalidate(self, account=None, suite=None, category=None):
+        """
+        Drop the entries for an account, a suite and/or a category of
+        metadata, or every entry if none is given. Returns how many were dropped.
+        """
+        pattern = (account, suite, category)
+        with self.lock:
+            keys = [key for key in self.entries
+                    if all(part is None or part == value for part, value in zip(pattern, key))]
+            for key in keys:
+                del self.entries[key]
+            self.counters['invalidations'] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        return self.invalidate()
+
+    def stats(self):
+        """ Hits, misses, expired entries, evictions, invalidations and the current size """
+        with self.lock:
+            stats = dict.fromkeys(['hits', 'misses', 'expired', 'evictions', 'invalidations'], 0)
+            stats.update(self.counters)
+            stats['size'] = len(self.entries)
+        return stats
+
+
+_default_metadata_cache = MetadataCache()
+
+
+def default_metadata_cache():
+    """ The metadata cache shared by every account that isn't given one """
+    return _default_metadata_cache
@@ -7,17 +7,55 @@ import logging
 from .import utils
 
 
+def _intern(string):
+    """
+    One shared copy of every distinct title and id. Only byte strings can be
+    interned, and Python drops them again once nothing refers to them.
+    Unicode ids are shared along with the metadata definitions they come from.
+    """
+    if type(string) is str:
+        return intern(string)
+    return string
+
+
 class Value(object):
-    """ Searchable Dict. Can search on both the key and the value """
+    """ Searchable Dict. Can search on both the key and the value
+
+    Values are kept small, since there can be many thousands of them:
+    they have no instance dictionary, their titles and ids are interned and
+    every other attribute is read from the API's own dictionary, `raw`,
+    rather than copied onto the value.
+    """
+    __slots__ = ('title', 'id', 'parent', 'raw', '_properties')
+    log = logging.getLogger(__name__)
+
     def __init__(self, title, id, parent, extra={}):
-        self.log = logging.getLogger(__name__)
-        self.title = title.encode('utf-8')
-        self.id = id
+        if isinstance(title, unicode):
+            title = title.encode('utf-8')
+        self.title = _intern(title)
+        self.id = _intern(id)
         self.parent = parent
-        self.properties = {'id': id}
-
-        for k, v in extra.items():
-            setattr(self, k, v)
+        self.raw = extra
+        self._properties = None
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't slots, like `name` or `decimals`
+        if name == 'raw':
+            raise AttributeError(name)
+        try:
+            return self.raw[name]
+        except KeyError:
+            raise AttributeError("{0!r} has no attribute {1!r}".format(self.__class__.__name__, name))
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            self._properties = {'id': self.id}
+        return self._properties
+
+    @properties.setter
+    def properties(self, properties):
+        self._properties = properties
 
     @classmethod
     def list(cls, name, items, parent, title='title', id='id'):
@@ -26,10 +64,10 @@ class Value(object):
 
     def __repr__(self):
         print self
-        return "<{title}: {id} in {parent}>".format(**self.__dict__)
+        return "<{title}: {id} in {parent}>".format(title=self.title, id=self.id, parent=self.parent)
 
     def copy(self):
-        value = self.__class__(self.title, self.id, self.parent)
+        value = self.__class__(self.title, self.id, self.parent, self.raw)
         value.properties = copy(self.properties)
         return value
 
@@ -49,6 +87,8 @@ class Value(object):
 
 class Element(Value):
     """ An element that you can use in the Reports to get data back """
+    __slots__ = ()
+
     def range(self, *vargs):
         l = len(vargs)
         if l == 1:
@@ -86,4 +126,4 @@ class Element(Value):
 
 
 class Segment(Element):
-    pass
+    __slots__ = ()
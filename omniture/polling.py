@@ -0,0 +1,131 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import json
+import logging
+import math
+import os
+import time
+
+from . import utils
+
+
+class Backoff(object):
+    """
+    The default polling strategy: wait `interval` seconds before the first
+    check and half as long again before every next one, up to `maximum`.
+    """
+    def __init__(self, maximum=30):
+        self.maximum = maximum
+
+    def intervals(self, query, interval=1):
+        """ Yield how many seconds to wait before each check on a report """
+        while True:
+            yield interval
+            interval = utils.backoff(interval, self.maximum)
+
+    def record(self, query, seconds):
+        """ Learn how long a report took to be ready. Backoff doesn't learn """
+        pass
+
+
+class AdaptivePolling(Backoff):
+    """
+    Polling strategy that learns how long reports take to be ready.
+
+    Timings are kept per report shape (suite, source, elements, number of
+    metrics, granularity and the rough length of the date range) as a moving
+    average in a JSON file, which can be shared between processes. The first
+    check is made shortly before a report of the same shape is expected to
+    be ready, followed by quick checks until it is. Reports of a shape that
+    hasn't been seen before fall back to the regular back off.
+
+    * path -- file to keep the timings in
+    * lead -- make the first check after this fraction of the expected time
+    * step -- fraction of the expected time to wait between later checks
+    * smoothing -- weight of the latest timing in the moving average
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.omniture', 'timings.json')
+
+    def __init__(self, path=DEFAULT_PATH, lead=0.8, step=0.1, smoothing=0.3, maximum=30):
+        super(AdaptivePolling, self).__init__(maximum)
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.lead = lead
+        self.step = step
+        self.smoothing = smoothing
+        utils.ensure_directory(path)
+        self.timings = self._load()
+
+    def expected(self, query):
+        """ Seconds a report of this shape usually takes to be ready, or None """
+        timing = self.timings.get(shape(query))
+        if timing:
+            return timing['mean']
+        return None
+
+    def intervals(self, query, interval=1):
+        expected = self.expected(query)
+        if expected is None:
+            for wait in super(AdaptivePolling, self).intervals(query, interval):
+                yield wait
+            return
+
+        now = time.time()
+        elapsed = now - (query.queued_at or now)
+        self.log.debug("Expecting report %s to be ready in %.1f seconds", query.id, expected)
+        yield max(expected * self.lead - elapsed, interval)
+
+        wait = max(expected * self.step, interval)
+        waited = expected * self.lead
+        while True:
+            yield wait
+            waited = waited + wait
+            # once the report is late, fall back to backing off
+            if waited > expected * 2:
+                wait = utils.backoff(wait, self.maximum)
+
+    def record(self, query, seconds):
+        key = shape(query)
+        with utils.FileLock(self.path + '.lock'):
+            self.timings = self._load()
+            timing = self.timings.get(key)
+            if timing:
+                timing['mean'] = timing['mean'] + self.smoothing * (seconds - timing['mean'])
+                timing['count'] = timing['count'] + 1
+            else:
+                timing = {'mean': seconds, 'count': 1}
+            self.timings[key] = timing
+            utils.atomic_write(self.path, json.dumps(self.timings, indent=4, sort_keys=True))
+        self.log.debug("Report %s took %.1f seconds, %s now averages %.1f",
+                       query.id, seconds, key, timing['mean'])
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return {}
+
+
+def shape(query):
+    """ A key describing the kind of report a query asks for """
+    raw = query.raw
+    elements = [str(element.get('id')) for element in raw.get('elements') or []]
+
+    days = 1
+    if raw.get('dateFrom') and raw.get('dateTo'):
+        try:
+            days = (utils.date(raw['dateTo']) - utils.date(raw['dateFrom'])).days + 1
+        except ValueError:
+            pass
+
+    return "|".join([
+        str(raw.get('reportSuiteID', '')),
+        str(raw.get('source', '')),
+        ",".join(elements),
+        str(len(raw.get('metrics') or [])),
+        str(raw.get('dateGranularity', '')),
+        # 1 day, 2-3 days, 4-7 days and so on
+        str(int(math.log(max(days, 1), 2))),
+    ])
@@ -2,19 +2,22 @@
 from __future__ import absolute_import
 
 import time
-from copy import copy, deepcopy
+import collections
+from copy import copy
+from datetime import timedelta
 import functools
 from dateutil.relativedelta import relativedelta
 import json
 import logging
 import sys
-import pandas as pd
-import io
-import requests
 
 from .elements import Value
+from . import batch
+from . import polling
 from . import reports
+from . import scheduler as schedulers
 from . import utils
+from . import warehouse
 
 
 def immutable(method):
@@ -50,10 +53,18 @@ class Query(object):
         #the raw query and have it work as is
         self.raw['reportSuiteID'] = str(self.suite.id)
         self.id = None
+        self.queued_at = None
         self.report = reports.Report
         self.method = "Get"
         self.data_frame = None
         self.appended_data = []
+        self.cache_checked = False
+        self.cached_response = None
+        self.download_options = {}
+        self.split_days = None
+        self.split_workers = 4
+        self.parts = None
+        self.part_reports = None
 
     def _normalize_value(self, value, category):
         if isinstance(value, Value):
@@ -62,7 +73,8 @@ class Query(object):
             return getattr(self.suite, category)[value]
 
     def _serialize_value(self, value, category):
-        return self._normalize_value(value, category).serialize()
+        # a copy, so the report description doesn't share its dict with the value
+        return dict(self._normalize_value(value, category).serialize())
 
     def _serialize_values(self, values, category):
         if not isinstance(values, list):
@@ -74,19 +86,39 @@ class Query(object):
         if isinstance(obj, list):
             return [self._serialize(el) for el in obj]
         elif isinstance(obj, Value):
-            return obj.serialize()
+            return dict(obj.serialize())
         else:
             return obj
 
     def clone(self):
-        """ Return a copy of the current object. """
-        query = Query(self.suite)
+        """ Return a copy of the current object.
+
+        Clones share whatever parts of `raw` they have in common. Only the
+        top level of `raw` is copied, and lists like `elements`, `metrics` and
+        `segments` are replaced instead of changed in place when something is
+        added to them, so a clone never changes the query it came from.
+        """
+        query = Query.__new__(Query)
+        query.log = self.log
+        query.suite = self.suite
         query.raw = copy(self.raw)
+        query.id = None
+        query.queued_at = None
         query.report = self.report
+        query.method = self.method
+        query.data_frame = None
+        query.appended_data = []
+        query.cache_checked = False
+        query.cached_response = None
+        query.download_options = self.download_options
+        query.split_days = self.split_days
+        query.split_workers = self.split_workers
+        query.parts = None
+        query.part_reports = None
         return query
 
     @immutable
-    def range(self, start, stop=None, months=0, days=0, granularity=None):
+    def range(self, start, stop=None, months=0, days=0, granularity=None, split=None, split_workers=4):
         """
         Define a date range for the report.
 
@@ -96,6 +128,11 @@ class Query(object):
         * months (optional, named) -- months to run used for relative dates
         * days (optional, named)-- days to run used for relative dates)
         * granulartiy (optional, named) -- set the granularity for the report
+        * split (optional, named) -- run the report as separate reports of
+            this many days each, concurrently, and stitch them back together.
+            Only for reports with an hour or day granularity
+        * split_workers (optional, named) -- how many of those reports are
+            queued and checked on at the same time
         """
         start = utils.date(start)
         stop = utils.date(stop)
@@ -120,6 +157,10 @@ class Query(object):
         if granularity:
             self.raw = self.granularity(granularity).raw
 
+        if split:
+            self.split_days = split
+            self.split_workers = split_workers
+
         return self
 
     @immutable
@@ -168,29 +209,28 @@ class Query(object):
         # It would appear to me that 'segment_id' has a strict subset
         # of the functionality of 'segments', but until I find out for
         # sure, I'll provide both options.
-        if not self.raw.has_key('segments'):
-            self.raw['segments'] = []
-
         if disable_validation == False:
             if segments:
-                self.raw['segments'].append(self._serialize_values(segments, 'segments'))
+                segment = self._serialize_values(segments, 'segments')
             elif segment:
-                self.raw['segments'].append({"id":self._normalize_value(segment,
-                                                                            'segments').id})
+                segment = {"id":self._normalize_value(segment, 'segments').id}
             elif kwargs:
-                self.raw['segments'].append(kwargs)
+                segment = kwargs
             else:
                 raise ValueError()
 
         else:
             if segments:
-                self.raw['segments'].append(segments)
+                segment = segments
             elif segment:
-                self.raw['segments'].append({"id":segment})
+                segment = {"id":segment}
             elif kwargs:
-                self.raw['segments'].append(kwargs)
+                segment = kwargs
             else:
                 raise ValueError()
+
+        #never append in place, the list may be shared with other queries
+        self.raw['segments'] = self.raw.get('segments', []) + [segment]
         return self
 
     @immutable
@@ -203,9 +243,6 @@ class Query(object):
         After the first element, each additional element is considered
             a breakdown
         """
-        if self.raw.get('elements', None) == None:
-            self.raw['elements'] = []
-
         if disable_validation == False:
             element = self._serialize_value(element, 'elements')
         else:
@@ -213,7 +250,7 @@ class Query(object):
 
         if kwargs != None:
             element.update(kwargs)
-        self.raw['elements'].append(deepcopy(element))
+        self.raw['elements'] = (self.raw.get('elements') or []) + [element]
         #TODO allow this method to accept a list
         return self
 
@@ -253,12 +290,11 @@ class Query(object):
         This method is intended to be called multiple time.
             Each time a metric will be added to the report
         """
-        if self.raw.get('metrics', None) == None:
-            self.raw['metrics'] = []
         if disable_validation == False:
-            self.raw['metrics'].append(self._serialize_value(metric, 'metrics'))
+            metric = self._serialize_value(metric, 'metrics')
         else:
-            self.raw['metrics'].append({"id":metric})
+            metric = {"id":metric}
+        self.raw['metrics'] = (self.raw.get('metrics') or []) + [metric]
         #self.raw['metrics'] = self._serialize_values(metric, 'metrics')
         #TODO allow this metric to accept a list
         return self
@@ -283,6 +319,30 @@ class Query(object):
         self.raw['currentData'] = True
         return self
 
+    @immutable
+    def download(self, workers=4, retries=30, retry_interval=10, sink=None, checkpoint=None):
+        """
+        Set how the pages of a Data Warehouse report are downloaded
+        once the report is ready.
+
+        * workers -- number of pages to fetch concurrently
+        * retries -- how often to retry a page that isn't available yet
+        * retry_interval -- seconds to wait before retrying a page
+        * sink -- stream the pages to a CSV file, a Parquet file (a path
+            ending in .parquet) or a function called with each page number
+            and DataFrame, instead of keeping the whole report in memory
+        * checkpoint -- path of a manifest to keep track of the pages written
+            to the sink, which has to be a CSV file. If the download is
+            interrupted, running the same query again resumes it after the
+            last complete page.
+        """
+        if checkpoint and not getattr(warehouse.build_sink(sink), 'resumable', False):
+            raise ValueError("Checkpoints need a CSV file as the sink")
+        self.download_options = dict(workers=workers, retries=retries,
+                                     retry_interval=retry_interval, sink=sink,
+                                     checkpoint=checkpoint)
+        return self
+
     # TODO: data warehouse reports are a work in progress
     @immutable
     def data(self, metrics, breakdowns):
@@ -309,114 +369,304 @@ class Query(object):
             return {'reportDescription': self.raw}
 
     def queue(self):
-        """ Submits the report to the Queue on the Adobe side. """
+        """ Submits the report to the Queue on the Adobe side.
+
+        Does nothing when the finished report is in the report cache.
+        """
+        if self._cached() is not None:
+            return self
+        if self.split_days:
+            return self._queue_chunks(self.split_workers)
+
+        checkpoint = self._checkpoint()
+        if checkpoint and checkpoint.report_id:
+            self.log.info("Resuming report %s", checkpoint.report_id)
+            self.id = checkpoint.report_id
+            return self
+
         q = self.build()
         self.log.debug("Suite Object: %s  Method: %s, Query %s",
                        self.suite, self.report.method, q)
         self.id = self.suite.request('Report',
                                      self.report.method,
                                      q)['reportID']
+        self.queued_at = time.time()
+        if checkpoint:
+            checkpoint.start(self.id)
         return self
 
     def probe(self, fn, heartbeat=None, interval=1, soak=False):
         """ Evaluate the response of a report"""
-        status = 'not ready'
-        while status == 'not ready':
+        #The account's polling strategy decides how long to wait between checks
+        for wait in self.intervals(interval):
+            self.log.debug("Check Interval: %s seconds", wait)
             if heartbeat:
                 heartbeat()
-            time.sleep(interval)
+            time.sleep(wait)
 
-            import json as js
-            dict_Value = None
-            flag = False
-            loop_timeout = 1
-            total_row_count = 0
             #Loop until the report is done
             #(No longer raises the ReportNotReadyError)
-            try:
-                response = fn()
-                if self.raw['source'] == 'warehouse':
-                    self.data_frame = pd.read_csv(io.StringIO(response.text))
-                    while flag == False:
-                        time.sleep(10)
-                        try:
-                            response = fn()
-                            if response.status_code == 400:
-                                dict_Value = js.loads(response.content)
-                                if dict_Value['error'] == 'no_warehouse_data':
-                                    loop_timeout = loop_timeout + 1
-                                    if loop_timeout > 30:
-                                        break
-                                    else:
-                                        continue
-                                else:
-                                    flag = True
-                                    break
-                            elif response.status_code == 200:
-                                df2 = pd.read_csv(io.StringIO(response.text))
-                                total_row_count = total_row_count + len(df2)
-                                print total_row_count
-                                self.appended_data.append(df2)
-                        except requests.ConnectionError as e:
-                            continue
-                    #appending the dataframes
-                    self.appended_data.append(self.data_frame)
-                    self.appended_data = pd.concat(self.appended_data, axis=0)
-                    dict_Value = js.loads(response.content)
-                    if dict_Value['error'] == 'eof_or_invalid_page':
-                        status = 'done'
-                        print total_row_count
-                        return  self.appended_data
-                else:
-                    status = 'done'
-                    return response
-            except reports.ReportNotReadyError:
-                status = 'not ready'
-               # if not soak and status not in ['not ready', 'done', 'ready']:
-                    #raise reports.InvalidReportError(response)
-
-            #Use a back off up to 30 seconds to play nice with the APIs
-            if interval < 30:
-                interval = round(interval * 1.5)
-            else:
-                interval = 30
-            self.log.debug("Check Interval: %s seconds", interval)
+            response = self.poll(fn)
+            if response is not None:
+                return response
+
+    def intervals(self, interval=1):
+        """ Seconds to wait before each check on the report, as the account's polling strategy sees fit """
+        return self._polling().intervals(self, interval)
+
+    def _polling(self):
+        return getattr(self.suite.account, 'polling', None) or polling.Backoff()
+
+    def poll(self, fn):
+        """ Make a single attempt at fetching the report. Returns None if it isn't ready yet """
+        try:
+            response = fn()
+        except reports.ReportNotReadyError:
+            return None
+
+        if self.queued_at:
+            self._polling().record(self, time.time() - self.queued_at)
+            self.queued_at = None
+
+        if self.raw.get('source') == 'warehouse':
+            return self._download().collect(response)
+        else:
+            return response
+
+    def _get_report(self):
+        if self.raw.get('source') == 'warehouse':
+            download = self._download()
+            return download.request(download.start)
+        return self.suite.request('Report', 'Get', {'reportID': self.id})
+
+    def _download(self):
+        return warehouse.Download(self, **self.download_options)
+
+    def _checkpoint(self):
+        path = self.download_options.get('checkpoint')
+        if path and self.raw.get('source') == 'warehouse':
+            return warehouse.Checkpoint(path, self.build())
+        return None
+
+    def check(self):
+        """
+        Check on the report a single time without blocking.
+
+        Returns the Report once it is ready and None while Adobe is still
+        processing it. Queues the report first if that hasn't happened yet.
+        """
+        if self._cached() is not None:
+            return self.report(self._cached(), self)
+        if not self.id:
+            self.queue()
+        if self.parts is not None:
+            return self._check_chunks()
+
+        response = self.poll(self._get_report)
+        if response is None:
+            return None
+        self._store(response)
+        return self.report(response, self)
+
+    def chunks(self):
+        """
+        Split the report into one query per `split` days of its date range.
+        """
+        if self.raw.get('dateGranularity') not in ('hour', 'day'):
+            raise ValueError("Only reports with an hour or day granularity can be split")
+        if self.report != reports.Report or self.raw.get('source') == 'warehouse':
+            raise ValueError("Data Warehouse reports can't be split")
+        if not self.raw.get('dateFrom') or not self.raw.get('dateTo'):
+            raise ValueError("Splitting a report requires a date range")
+
+        start = utils.date(self.raw['dateFrom'])
+        stop = utils.date(self.raw['dateTo'])
+        chunks = []
+        while start <= stop:
+            end = min(start + timedelta(days=self.split_days - 1), stop)
+            chunk = self.range(start, end)
+            chunk.split_days = None
+            chunks.append(chunk)
+            start = end + timedelta(days=1)
+        return chunks
+
+    def _queue_chunks(self, max_workers):
+        """ Queue every chunk of the report, `max_workers` at a time """
+        parts = self.chunks()
+        submitted = batch.submit(parts, max_workers)
+        if submitted.failures:
+            # the report is queued all over again next time, so don't leave the chunks that made it running
+            for part in parts:
+                if part.id:
+                    try:
+                        part.cancel()
+                    except Exception:
+                        self.log.debug("Couldn't cancel report %s", part.id)
+            submitted.raise_for_failures()
+        self.parts = parts
+        self.part_reports = [None] * len(parts)
+        self.id = tuple(part.id for part in parts)
+        return self
+
+    def _stitch(self):
+        response = reports.stitch([report.raw for report in self.part_reports])
+        self._store(response)
+        return self.report(response, self)
+
+    def _check_chunks(self):
+        """ Check on every chunk that isn't ready yet, and stitch them together once they all are """
+        for index, part in enumerate(self.parts):
+            if self.part_reports[index] is None:
+                self.part_reports[index] = part.check()
+        if None in self.part_reports:
+            return None
+        return self._stitch()
+
+    def _sync_chunks(self, heartbeat=None, interval=1, max_workers=4):
+        """ Run every chunk of the report concurrently and stitch the results together """
+        if self.parts is None:
+            self._queue_chunks(max_workers)
+        with schedulers.Scheduler(max_workers, heartbeat, interval) as pool:
+            futures = [(index, pool.submit(part)) for index, part in enumerate(self.parts)
+                       if self.part_reports[index] is None]
+            for index, future in futures:
+                self.part_reports[index] = future.result()
+        return self._stitch()
+
+    def _page(self, number, top):
+        """ The query for one window of `top` values of the first element """
+        query = self.clone()
+        first = dict(self.raw['elements'][0], startingWith=str(number * top + 1), top=str(top))
+        query.raw['elements'] = [first] + self.raw['elements'][1:]
+        return query
+
+    def iter_pages(self, top=50000, max_workers=4, heartbeat=None, interval=1):
+        """
+        Page through every value of the first element of the report, `top`
+        values at a time, and yield a Report per page in order.
+
+        `max_workers` pages are run concurrently, ahead of the page being
+        read, until a page comes back with fewer than `top` values.
+        """
+        if not self.raw.get('elements'):
+            raise ValueError("Paging through a report requires an element")
+
+        pool = schedulers.Scheduler(max_workers, heartbeat, interval)
+        pending = collections.deque()
+        try:
+            for number in range(max_workers):
+                pending.append(pool.submit(self._page(number, top)))
+            number = max_workers
+
+            while pending:
+                report = pending.popleft().result()
+                if _count_values(report) < top:
+                    yield report
+                    break
+                pending.append(pool.submit(self._page(number, top)))
+                number = number + 1
+                yield report
+        finally:
+            pool.shutdown()
+            # pages past the last one were queued for nothing
+            for future in pending:
+                if not future.done() and future.query.id:
+                    try:
+                        future.query.cancel()
+                    except Exception:
+                        self.log.debug("Couldn't cancel report %s", future.query.id)
+
+    def iter_rows(self, top=50000, max_workers=4, batch_size=None, heartbeat=None, interval=1):
+        """
+        Go through the rows of every page of the report (see `iter_pages`)
+        as one stream of dicts, or lists of up to `batch_size` dicts.
+        """
+        pages = self.iter_pages(top, max_workers, heartbeat, interval)
+        rows = (row for report in pages for row in report.iter_rows())
+        if not batch_size:
+            return rows
+        return reports._batches(rows, batch_size)
 
     # only for SiteCatalyst queries
-    def sync(self, heartbeat=None, interval=1):
-        """ Run the report synchronously,"""
+    def sync(self, heartbeat=None, interval=1, max_workers=None):
+        """ Run the report synchronously,
+
+        `max_workers` overrides how many chunks of a split report are run at once.
+        """
+        if self._cached() is not None:
+            return self.report(self._cached(), self)
+        if self.split_days:
+            return self._sync_chunks(heartbeat, interval, max_workers or self.split_workers)
         if not self.id:
             self.queue()
 
         # this looks clunky, but Omniture sometimes reports a report
         # as ready when it's really not
-        get_report = lambda: self.suite.request('Report',
-                                                'Get',
-                                                {'reportID': self.id})
-        response = self.probe(get_report, heartbeat, interval)
+        response = self.probe(self._get_report, heartbeat, interval)
+        self._store(response)
         return self.report(response, self)
 
+    def _report_cache(self):
+        """ The account's report cache, if this kind of report can use it """
+        if self.report != reports.Report or self.raw.get('source') == 'warehouse':
+            return None
+        return self.suite.account.report_cache
+
+    def _cached(self):
+        """ The finished report from the report cache, looked up once per query """
+        if not self.cache_checked:
+            self.cache_checked = True
+            cache = self._report_cache()
+            if cache:
+                self.cached_response = cache.get_report(self.build()['reportDescription'])
+        return self.cached_response
+
+    def _store(self, response):
+        cache = self._report_cache()
+        if cache and isinstance(response, dict):
+            cache.set_report(self.build()['reportDescription'], response)
+
     #shortcut to run a report immediately
-    def run(self, defaultheartbeat=True, heartbeat=None, interval=1):
+    def run(self, defaultheartbeat=True, heartbeat=None, interval=1, max_workers=None):
         """Shortcut for sync(). Runs the current report synchronously. """
         if defaultheartbeat == True:
             rheartbeat = self.heartbeat
         else:
             rheartbeat = heartbeat
 
-        return self.sync(rheartbeat, interval)
+        return self.sync(rheartbeat, interval, max_workers)
 
     def heartbeat(self):
         """ A default heartbeat method that prints a dot for each request """
         sys.stdout.write('.')
         sys.stdout.flush()
 
+    def queue_async(self, scheduler=None):
+        """
+        Submit the report to the Queue without blocking.
+
+        Returns a Future that resolves to this query once it has a report ID.
+        """
+        scheduler = scheduler or schedulers.default_scheduler()
+        return scheduler.call(self.queue)
+
     # only for SiteCatalyst queries
-    def async(self, callback=None, heartbeat=None, interval=1):
-        if not self.id:
-            self.queue()
+    def async(self, callback=None, heartbeat=None, interval=1, scheduler=None):
+        """
+        Run the report in the background.
 
-        raise NotImplementedError()
+        Returns a Future straight away. The report is queued and polled by a
+        shared scheduler, so any number of reports can be in progress without
+        a thread per report. `callback` is called with the Report once it is ready.
+        """
+        scheduler = scheduler or schedulers.default_scheduler()
+        future = scheduler.submit(self, interval=interval, heartbeat=heartbeat)
+        if callback:
+            def done(future):
+                if future.exception() is None:
+                    callback(future.result())
+            future.add_done_callback(done)
+        return future
 
     # only for Data Warehouse queries
     def request(self, name='python-omniture query', ftp=None, email=None):
@@ -424,6 +674,8 @@ class Query(object):
 
     def cancel(self):
         """ Cancels a the report from the Queue on the Adobe side. """
+        if self.parts is not None:
+            return [part.cancel() for part in self.parts if part.id]
         if self.report == reports.DataWarehouseReport:
             return self.suite.request('DataWarehouse',
                                       'CancelRequest',
@@ -451,6 +703,14 @@ class Query(object):
 
     def __dir__(self):
         """ Give sensible options for Tab Completion mostly for iPython """
-        return ['async','breakdown','cancel','clone','currentData', 'element', 'source',
-                'filter', 'granularity', 'id','json' ,'metric', 'queue', 'range', 'raw', 'report',
-                'request', 'run', 'set', 'sortBy', 'suite']
+        return ['async','breakdown','cancel','check','chunks','clone','currentData', 'download', 'element', 'source',
+                'filter', 'granularity', 'id', 'iter_pages', 'iter_rows', 'json' ,'metric', 'queue', 'queue_async',
+                'range', 'raw', 'report', 'request', 'run', 'set', 'sortBy', 'suite']
+
+
+def _count_values(report):
+    """ The number of values of the first element in a report """
+    data = report.report['data']
+    if report.type == 'trended':
+        return max([len(row.get('breakdown') or []) for row in data] or [0])
+    return len(data)
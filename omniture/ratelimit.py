@@ -0,0 +1,147 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import threading
+import time
+
+from . import utils
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` requests per second on average, with bursts of up to
+    `burst` requests. Thread safe.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a request may be made. Returns the seconds spent waiting """
+        waited = 0
+        while True:
+            with self.lock:
+                wait = self._take(time.time())
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited = waited + wait
+
+    def _take(self, now):
+        """ Take a token if there is one, otherwise return how long until there is """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens = self.tokens - 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A token bucket whose state lives in a file, so that every process
+    using the same file shares the same budget.
+    """
+    def __init__(self, rate, burst=None, path=None, name='default'):
+        super(SharedTokenBucket, self).__init__(rate, burst)
+        self.path = path
+        self.name = name
+        self.lock = SharedLock(path, self)
+
+
+class SharedLock(object):
+    """ Loads a bucket's state from its file while the file is locked """
+    def __init__(self, path, bucket):
+        self.path = path
+        self.bucket = bucket
+        self.threads = threading.Lock()
+        self.file = utils.FileLock(path + '.lock')
+
+    def __enter__(self):
+        self.threads.acquire()
+        self.file.__enter__()
+        state = self._load().get(self.bucket.name)
+        if state:
+            self.bucket.tokens, self.bucket.updated = state
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            state = self._load()
+            state[self.bucket.name] = [self.bucket.tokens, self.bucket.updated]
+            # every reader holds the lock, so there's no need to write atomically
+            with open(self.path, 'wb') as fp:
+                json.dump(state, fp)
+        finally:
+            self.file.__exit__(*exc_info)
+            self.threads.release()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return {}
+
+
+class RateLimiter(object):
+    """
+    Keeps the requests an account makes within the API quota.
+
+    Limits are given in requests per second, either as a number or as
+    a (rate, burst) pair, for a method ('Report.Queue'), a whole API
+    ('Report') or as the default for everything else. The most specific
+    limit applies, and requests without a limit aren't held back.
+
+    Pass a path to share the limits with every other process that uses
+    the same path, for instance several jobs running under one company.
+
+    >>> limiter = RateLimiter({'Report.Queue': 1, 'Report.Get': (5, 10)}, default=2)
+    >>> analytics = omniture.authenticate(os.environ, rate_limit=limiter)
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.omniture', 'ratelimit.json')
+
+    def __init__(self, limits=None, default=None, path=None):
+        self.log = logging.getLogger(__name__)
+        if path is True:
+            path = self.DEFAULT_PATH
+        if path:
+            utils.ensure_directory(path)
+        self.path = path
+        self.buckets = {}
+        limits = dict(limits or {})
+        if default is not None:
+            limits['*'] = default
+        for name, limit in limits.items():
+            self.buckets[name] = self._build_bucket(name, limit)
+
+    def bucket(self, api, method):
+        """ The bucket that applies to a request, or None """
+        for name in (api + '.' + method, api, '*'):
+            if name in self.buckets:
+                return self.buckets[name]
+        return None
+
+    def acquire(self, api, method):
+        """ Block until a request to api.method fits within its limit """
+        bucket = self.bucket(api, method)
+        if bucket is None:
+            return
+        waited = bucket.acquire()
+        if waited:
+            self.log.debug("Held back %s.%s for %.2f seconds", api, method, waited)
+
+    def _build_bucket(self, name, limit):
+        if isinstance(limit, (tuple, list)):
+            rate, burst = limit
+        else:
+            rate, burst = limit, None
+        if self.path:
+            return SharedTokenBucket(rate, burst, self.path, name)
+        return TokenBucket(rate, burst)
@@ -2,12 +2,99 @@
 from __future__ import absolute_import
 
 import logging
+from collections import OrderedDict
 from datetime import datetime
 import json
 
 from .elements import Value
 
 
+def _parse_count(count):
+    """ Parse a count as an integer unless it has a fractional part """
+    try:
+        return int(count)
+    except ValueError:
+        return float(count)
+
+
+def _batches(iterable, size):
+    """ Group an iterable into lists of up to size items """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _period_key(row):
+    return tuple(int(row.get(part, 0)) for part in ('year', 'month', 'day', 'hour'))
+
+
+def _additive(metric):
+    """
+    Whether the totals of a metric over consecutive periods are the sum of
+    its totals for each period. Rates, times, unique visitors and
+    calculated metrics can't be added up.
+    """
+    return (metric.get('type') in ('number', 'currency')
+            and 'visitors' not in metric['id']
+            and not metric['id'].startswith('cm'))
+
+
+def _totals(metrics, rows):
+    """
+    Recompute the totals of additive metrics from the total of each period,
+    leaving None for the metrics that can't be added up.
+    """
+    totals = []
+    for index, metric in enumerate(metrics):
+        counts = [row.get('counts', row.get('breakdownTotal')) for row in rows]
+        if not _additive(metric) or not all(counts):
+            totals.append(None)
+            continue
+        total = sum(float(count[index]) for count in counts)
+        totals.append(str(int(total)) if total == int(total) else str(total))
+    return totals
+
+
+def stitch(responses):
+    """
+    Combine the responses of a trended report run over consecutive date
+    ranges into a single response, in date order. Periods that show up in
+    more than one response are only kept once.
+
+    Totals are recomputed from the periods that were kept, for metrics that
+    can be added up. The totals of other metrics, like unique visitors or
+    rates, are None.
+    """
+    first = responses[0]['report']
+    seen = set()
+    data = []
+    for response in responses:
+        for row in response['report']['data']:
+            key = _period_key(row)
+            if key not in seen:
+                seen.add(key)
+                data.append(row)
+    data.sort(key=_period_key)
+
+    report = dict(first)
+    report.update({
+        'data': data,
+        'totals': _totals(first.get('metrics', []), data),
+        'period': "{0} - {1}".format(first['period'].split(' - ')[0],
+                                     responses[-1]['report']['period'].split(' - ')[-1]),
+    })
+    return {
+        'report': report,
+        'waitSeconds': sum(float(response['waitSeconds']) for response in responses),
+        'runSeconds': sum(float(response['runSeconds']) for response in responses),
+    }
+
+
 class InvalidReportError(Exception):
     """
     Exception raised when the API says a report defintion is
@@ -36,7 +123,6 @@ class ReportNotReadyError(Exception):
         super(ReportNotReadyError, self).__init__("Report Not Ready")
 
 
-#  TODO: also make this iterable (go through rows)
 class Report(object):
     """
     Object to parse the responses of the report
@@ -44,6 +130,9 @@ class Report(object):
     To get the data use
     >>> report.data
 
+    To go through the rows one at a time without building the whole list use
+    >>> for row in report: ...
+
     To get a Pandas DataFrame use
     >>> report.dataframe
 
@@ -84,9 +173,12 @@ class Report(object):
             else:
                 self.segments = None
 
+            self.source = None
+
             #Set as none until it is actually used
             self.dict_data = None
             self.pandas_data = None
+            self._layout_cache = None
 
     @property
     def data(self):
@@ -101,78 +193,174 @@ class Report(object):
                 self.dict_data = self.parse_rows(self.report['data'])
             return self.dict_data
 
-    def parse_rows(self,row, level=0, upperlevels=None):
+    def parse_rows(self, rows):
+        """
+        Parse through the data returned by a report. Return a list of dicts.
         """
-        Parse through the data returned by a repor. Return a list of dicts.
+        columns = self._layout()[0]
+        return [dict(zip(columns, values)) for values in self._flatten(rows)]
 
-        This method is recursive.
+    def iter_rows(self, batch_size=None):
         """
-        #self.log.debug("Level %s, Upperlevels %s, Row Type %s, Row: %s", level,upperlevels, type(row), row)
-        data = {}
-        data_set = []
-
-        #merge in the upper levels
-        if upperlevels != None:
-            data.update(upperlevels)
-
-
-        if type(row) == list:
-            for r in row:
-                #on the first call set add to the empty list
-                pr = self.parse_rows(r,level, data.copy())
-                if type(pr) == dict:
-                    data_set.append(pr)
-                #otherwise add to the existing list
-                else:
-                    data_set.extend(pr)
+        Go through the rows of the report one at a time, as dicts.
 
-        #pull out the metrics from the lowest level
-        if type(row) == dict:
-            #pull out any relevant data from the current record
-            #Handle datetime isn't in the elements list for trended reports
-            if level == 0 and self.type == "trended":
-                element = "datetime"
-            elif self.type == "trended":
-                if hasattr(self.elements[level-1], 'classification'):
-                    #handle the case where there are multiple classifications
-                    element = str(self.elements[level-1].id) + ' | ' + str(self.elements[level-1].classification).encode('utf-8')
-                else:
-                    element = str(self.elements[level-1].id)
+        Rows are generated while walking the report, so memory use doesn't
+        grow with the size of the report. With a `batch_size` lists of up to
+        that many rows are yielded instead.
+
+        Warehouse reports downloaded to a CSV file are read back from the
+        file. Those sent to any other sink raise a ValueError.
+        """
+        if self.source == 'warehouse':
+            rows = (row.to_dict() for frame in self._warehouse_frames() for index, row in frame.iterrows())
+        else:
+            columns = self._layout()[0]
+            rows = (dict(zip(columns, values)) for values in self._flatten(self.report['data']))
+
+        if not batch_size:
+            return rows
+        return _batches(rows, batch_size)
+
+    def _warehouse_frames(self):
+        """
+        The rows of a warehouse report as DataFrames. Reports that were
+        written to a CSV file are read back from it a chunk at a time.
+        """
+        if hasattr(self.data_csv, 'iterrows'):
+            return [self.data_csv]
+        if isinstance(self.data_csv, basestring) and not self.data_csv.endswith('.parquet'):
+            import pandas as pd
+            return pd.read_csv(self.data_csv, chunksize=10000)
+        raise ValueError("The rows of report {0} went to a sink and can only be read back "
+                         "from a CSV file".format(self.query.id))
+
+    def __iter__(self):
+        return self.iter_rows()
+
+    def to_columns(self):
+        """
+        Returns the report data as an OrderedDict of column name -> list of values,
+        with one entry per row of the report.
+        """
+        columns = self._layout()[0]
+        arrays = [[] for column in columns]
+        appends = [array.append for array in arrays]
+        for values in self._flatten(self.report['data']):
+            for append, value in zip(appends, values):
+                append(value)
+        return OrderedDict(zip(columns, arrays))
+
+    def _level_keys(self):
+        """ The column name for each level of the breakdown tree """
+        #Handle datetime isn't in the elements list for trended reports
+        if self.type == "trended":
+            elements = [None] + list(self.elements)
+        else:
+            elements = list(self.elements)
+
+        keys = []
+        for element in elements:
+            if element is None:
+                keys.append("datetime")
+            elif hasattr(element, 'classification'):
+                #handle the case where there are multiple classifications
+                keys.append(str(element.id) + ' | ' + str(element.classification).encode('utf-8'))
             else:
-                if hasattr(self.elements[level], 'classification'):
-                    #handle the case where there are multiple classifications
-                    element = str(self.elements[level].id) + ' | ' + str(self.elements[level].classification).encode('utf-8')
-                else:
-                    element = str(self.elements[level].id)
+                keys.append(str(element.id))
+        return keys
 
+    def _layout(self):
+        """
+        Work out the columns of the report once, up front.
 
-            if element == "datetime":
-                data[element] = datetime(int(row.get('year',0)),int(row.get('month',0)),int(row.get('day',0)),int(row.get('hour',0)))
-                data["datetime_friendly"] = str(row['name'])
+        Returns the column names, the level keys, a plan per depth of the tree
+        saying which (level, part) fills each element column of a row that
+        ends at that depth, and a parser per metric.
+        """
+        if self._layout_cache is not None:
+            return self._layout_cache
+
+        keys = self._level_keys()
+        element_columns = []
+        sources = {}
+        for level, key in enumerate(keys):
+            if key == "datetime":
+                parts = ["datetime", "datetime_friendly"]
             else:
-                try:
-                    data[element] = row['name'].encode('utf-8')
+                parts = [key]
+            for part, column in enumerate(parts):
+                if column not in sources:
+                    element_columns.append(column)
+                    sources[column] = []
+                sources[column].append((level, part))
+
+        plans = []
+        for depth in range(len(keys)):
+            plan = []
+            for column in element_columns:
+                # deeper levels win when the same column shows up twice
+                found = [source for source in sources[column] if source[0] <= depth]
+                plan.append(found[-1] if found else None)
+            plans.append(plan)
+
+        parsers = []
+        metric_columns = []
+        for metric in self.metrics:
+            metric_columns.append(str(metric.id))
+            #decide what type of event
+            if getattr(metric, 'decimals', 0) > 0:
+                parsers.append(float)
+            else:
+                parsers.append(_parse_count)
+
+        self._layout_cache = (element_columns + metric_columns, keys, plans, parsers)
+        return self._layout_cache
 
+    def _flatten(self, rows):
+        """
+        Walk the nested breakdowns of a report without recursion and
+        yield a tuple of values for every row at the bottom of the tree.
+        """
+        columns, keys, plans, parsers = self._layout()
+        empty_counts = (None,) * len(parsers)
+        current = [None] * len(keys)
+        stack = [iter(rows)]
+
+        while stack:
+            try:
+                row = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+            level = len(stack) - 1
+
+            #pull out any relevant data from the current record
+            if keys[level] == "datetime":
+                current[level] = (datetime(int(row.get('year', 0)), int(row.get('month', 0)),
+                                           int(row.get('day', 0)), int(row.get('hour', 0))),
+                                  str(row['name']))
+            else:
+                try:
+                    current[level] = (row['name'].encode('utf-8'),)
                 # If the name value is Null or non-encodable value, return null
                 except:
-                    data[element] = "null"
-            #parse out any breakdowns and add to the data set
-            if row.has_key('breakdown') and len(row['breakdown']) > 0:
-                data_set.extend(self.parse_rows(row['breakdown'], level+1, data))
-            elif row.has_key('counts'):
-                for index, metric in enumerate(row['counts']):
-                        #decide what type of event
-                        if self.metrics[index].decimals > 0 or metric.find('.') >-1:
-                            data[str(self.metrics[index].id)] = float(metric)
-                        else:
-                            data[str(self.metrics[index].id)] = int(metric)
-
-
-
-        if len(data_set)>0:
-            return data_set
-        else:
-            return data
+                    current[level] = ("null",)
+
+            #parse out any breakdowns before emitting anything
+            breakdown = row.get('breakdown')
+            if breakdown:
+                stack.append(iter(breakdown))
+                continue
+
+            values = [current[source[0]][source[1]] if source else None
+                      for source in plans[level]]
+            counts = row.get('counts')
+            if counts:
+                values.extend([parse(count) for parse, count in zip(parsers, counts)])
+                values.extend(empty_counts[len(counts):])
+            else:
+                values.extend(empty_counts)
+            yield tuple(values)
 
     @property
     def dataframe(self):
@@ -191,8 +379,32 @@ class Report(object):
 
 
     def to_dataframe(self):
+        """
+        Build a DataFrame straight from the report columns, without going
+        through `data`. Metrics become int64 or float64 columns, elements
+        become categoricals and the date of trended reports becomes datetime64.
+        """
+        import numpy as np
         import pandas as pd
-        return pd.DataFrame.from_dict(self.data)
+
+        columns, keys, plans, parsers = self._layout()
+        metric_columns = set(columns[len(columns) - len(parsers):])
+        data = self.to_columns()
+
+        frame = OrderedDict()
+        for column in columns:
+            # free every list as soon as its array exists
+            values = data.pop(column)
+            if column in metric_columns:
+                if all(isinstance(value, (int, long)) for value in values):
+                    frame[column] = np.array(values, dtype=np.int64)
+                else:
+                    frame[column] = np.array(values, dtype=np.float64)
+            elif column == "datetime":
+                frame[column] = pd.to_datetime(values)
+            else:
+                frame[column] = pd.Categorical(values)
+        return pd.DataFrame(frame, columns=columns)
 
 
     def serialize(self, verbose=False):
@@ -223,7 +435,7 @@ class Report(object):
 
     def __div__(self):
         """ Give sensible options for Tab Completion mostly for iPython """
-        return ['data','dataframe', 'metrics','elements', 'segments', 'period', 'type', 'timing']
+        return ['data','dataframe', 'iter_rows', 'metrics','elements', 'segments', 'period', 'type', 'timing']
 
     def _repr_html_(self):
         """ Format in HTML for iPython Users """
@@ -0,0 +1,116 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import collections
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+
+class RetryPolicy(object):
+    """
+    Retries API requests that fail for reasons that tend to go away:
+    dropped or refused connections, timeouts and 5xx or 429 responses.
+
+    Every retry waits a random time up to `backoff * 2 ** (retry - 1)`
+    seconds, capped at `maximum`, so that clients that fail together
+    don't come back together. `budgets` sets how often a method
+    ('Report.Get') or a whole API ('Report') may be retried, instead of
+    `retries`.
+
+    Requests that aren't idempotent, like Report.Queue, would queue the
+    report twice if the first attempt did reach Adobe. They are only
+    retried when the connection couldn't be made at all or Adobe asked
+    to slow down.
+
+    Counters of requests, retries and failures per method are kept in
+    `stats()`.
+
+    >>> analytics = omniture.authenticate(os.environ, retry=RetryPolicy(retries=5, budgets={'Report.Get': 10}))
+    """
+    STATUSES = (429, 500, 502, 503, 504)
+    NOT_IDEMPOTENT = ('Report.Queue', 'Report.CancelReport',
+                      'DataWarehouse.Request', 'DataWarehouse.CancelRequest')
+
+    def __init__(self, retries=3, backoff=0.5, maximum=30, jitter=True, budgets=None,
+                 statuses=STATUSES, not_idempotent=NOT_IDEMPOTENT):
+        self.log = logging.getLogger(__name__)
+        self.retries = retries
+        self.backoff = backoff
+        self.maximum = maximum
+        self.jitter = jitter
+        self.budgets = budgets or {}
+        self.statuses = statuses
+        self.not_idempotent = not_idempotent
+        self.counters = collections.defaultdict(collections.Counter)
+        self.lock = threading.Lock()
+
+    def budget(self, api, method):
+        """ How often a request to api.method may be retried """
+        for name in (api + '.' + method, api):
+            if name in self.budgets:
+                return self.budgets[name]
+        return self.retries
+
+    def delay(self, retry):
+        """ Seconds to wait before a retry """
+        delay = min(self.maximum, self.backoff * 2 ** (retry - 1))
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+    def call(self, api, method, fn):
+        """ Call `fn` to make a request to api.method, retrying as needed """
+        name = api + '.' + method
+        budget = self.budget(api, method)
+        idempotent = name not in self.not_idempotent
+        retry = 0
+        while True:
+            self._count(name, 'requests')
+            try:
+                response = fn()
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if retry >= budget or not (idempotent or not_sent(error)):
+                    self._count(name, 'failures')
+                    raise
+                reason = error.__class__.__name__
+            else:
+                if response.status_code not in self.statuses:
+                    return response
+                if retry >= budget or not (idempotent or response.status_code == 429):
+                    self._count(name, 'failures')
+                    return response
+                reason = "HTTP {}".format(response.status_code)
+
+            retry = retry + 1
+            delay = self.delay(retry)
+            self._count(name, 'retries')
+            self.log.warning("%s failed (%s), retry %s of %s in %.1f seconds",
+                             name, reason, retry, budget, delay)
+            time.sleep(delay)
+
+    def stats(self):
+        """ Requests, retries and failures per method, and in total """
+        with self.lock:
+            stats = dict((name, dict(counter)) for name, counter in self.counters.items())
+        total = collections.Counter()
+        for counter in stats.values():
+            total.update(counter)
+        stats['total'] = dict(total)
+        return stats
+
+    def _count(self, name, counter):
+        with self.lock:
+            self.counters[name][counter] += 1
+
+
+def not_sent(error):
+    """ Whether a request that raised this error surely never reached the server """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
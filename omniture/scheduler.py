@@ -0,0 +1,269 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+import Queue
+
+
+class ReportTimeoutError(Exception):
+    """ Exception raised when a report isn't ready within the allotted time """
+    pass
+
+
+class Future(object):
+    """
+    The eventual result of a report that is being polled in the background.
+
+    Use `result()` to block until the report is ready, or register a
+    callback with `add_done_callback()`.
+    """
+    def __init__(self, query, key=None):
+        self.query = query
+        self.key = key
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._finished = False
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        """ Whether the report has finished (successfully or not) """
+        return self._finished
+
+    def result(self, timeout=None):
+        """ Block until the report is ready and return it """
+        self._wait(timeout)
+        if self._exc_info:
+            exc_type, exc_value, traceback = self._exc_info
+            raise exc_type, exc_value, traceback
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Block until the report is done and return the error it raised, if any """
+        self._wait(timeout)
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def _wait(self, timeout):
+        if self._finished:
+            return
+        if not self._event.wait(timeout):
+            raise ReportTimeoutError("{!r} wasn't ready within {} seconds"
+                                     .format(self, timeout))
+
+    def add_done_callback(self, fn):
+        """ Call `fn(future)` once the report is done, straight away if it already is """
+        with self._lock:
+            if not self._finished:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._finished = True
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logging.getLogger(__name__).exception("Callback for %r failed", self)
+        self._event.set()
+
+    def __repr__(self):
+        state = 'done' if self.done() else 'pending'
+        if self.query is None:
+            return "<omniture.Future ({0})>".format(state)
+        return "<omniture.Future {0} ({1})>".format(self.query.id, state)
+
+
+class Scheduler(object):
+    """
+    Polls any number of queued reports from a fixed pool of worker threads.
+
+    Each worker makes at most one API request at a time, so `max_workers`
+    is a global cap on the number of requests in flight. Reports that aren't
+    ready yet are put back in line, waiting as long as `Query.probe` would.
+
+    >>> with Scheduler(max_workers=4) as scheduler:
+    ...     futures = [scheduler.submit(query) for query in queries]
+    ...     for future in as_completed(futures):
+    ...         print future.result()
+    """
+    def __init__(self, max_workers=4, heartbeat=None, interval=1):
+        self.log = logging.getLogger(__name__)
+        self.max_workers = max_workers
+        self.heartbeat = heartbeat
+        self.interval = interval
+        self._pending = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._workers = []
+        for index in range(max_workers):
+            worker = threading.Thread(target=self._work,
+                                      name='omniture-scheduler-{}'.format(index))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, query, key=None, interval=None, heartbeat=None):
+        """ Start polling a query in the background. Returns a Future """
+        future = Future(query, key)
+        if interval is None:
+            interval = self.interval
+        self._schedule(_Poll(future, heartbeat or self.heartbeat), interval)
+        return future
+
+    def call(self, fn, *vargs, **kwargs):
+        """ Run `fn` once on one of the workers. Returns a Future of its result """
+        future = Future(None)
+        self._schedule(_Call(future, fn, vargs, kwargs), 0)
+        return future
+
+    def shutdown(self, wait=True):
+        """ Stop the workers. Reports that are still pending won't complete """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                if worker is not threading.current_thread():
+                    worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _schedule(self, task, interval):
+        with self._condition:
+            task.interval = interval
+            due = time.time() + interval
+            heapq.heappush(self._pending, (due, next(self._counter), task))
+            self._condition.notify()
+
+    def _next(self):
+        """ Wait for the next poll that is due. Returns None on shutdown """
+        with self._condition:
+            while not self._shutdown:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+                delay = self._pending[0][0] - time.time()
+                if delay <= 0:
+                    return heapq.heappop(self._pending)
+                self._condition.wait(delay)
+            return None
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            due, count, task = item
+
+            try:
+                finished = task.run()
+            except Exception:
+                task.future.set_exception(sys.exc_info())
+                continue
+
+            if not finished:
+                interval = task.next_interval()
+                self.log.debug("Check Interval for %s: %s seconds", task.future.query.id, interval)
+                self._schedule(task, interval)
+
+
+class _Poll(object):
+    """ Checks on a report until it is ready """
+    def __init__(self, future, heartbeat=None):
+        self.future = future
+        self.heartbeat = heartbeat
+        self.interval = None
+        self.waits = None
+
+    def next_interval(self):
+        # the report is queued by the first check, so only start
+        # timing it from there
+        if self.waits is None:
+            self.waits = self.future.query.intervals(self.interval)
+        return next(self.waits)
+
+    def run(self):
+        if self.heartbeat:
+            self.heartbeat()
+        report = self.future.query.check()
+        if report is None:
+            return False
+        self.future.set_result(report)
+        return True
+
+
+class _Call(object):
+    """ Runs a function once """
+    def __init__(self, future, fn, vargs, kwargs):
+        self.future = future
+        self.fn = fn
+        self.vargs = vargs
+        self.kwargs = kwargs
+        self.interval = None
+
+    def run(self):
+        self.future.set_result(self.fn(*self.vargs, **self.kwargs))
+        return True
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler():
+    """
+    The scheduler shared by `Query.async`, `Query.queue_async` and
+    `Account.request_async`. It is started the first time it is needed.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler()
+        return _default
+
+
+def as_completed(futures, timeout=None):
+    """
+    Iterate over futures as they finish, regardless of the order
+    they were submitted in.
+    """
+    futures = list(futures)
+    finished = Queue.Queue()
+    for future in futures:
+        future.add_done_callback(finished.put)
+
+    if timeout is not None:
+        deadline = time.time() + timeout
+    for _ in futures:
+        if timeout is None:
+            yield finished.get()
+        else:
+            try:
+                yield finished.get(True, max(0, deadline - time.time()))
+            except Queue.Empty:
+                raise ReportTimeoutError("Reports weren't ready within {} seconds"
+                                         .format(timeout))
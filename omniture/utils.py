@@ -2,33 +2,44 @@ from __future__ import absolute_import
 
 import copy
 import datetime
+import errno
+import os
+import tempfile
 from dateutil.parser import parse as parse_date
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-class memoize:
-    def __init__(self, function):
-        self.function = function
-        self.memoized = {}
 
-    def __call__(self, *args):
-        try:
-            return self.memoized[args]
-        except KeyError:
-            self.memoized[args] = self.function(*args)
-            return self.memoized[args]
+def _invalidates(method):
+    """ Wrap a list method so that it drops the lookup indexes of an AddressableList """
+    def wrapped_method(self, *vargs, **kwargs):
+        self._indexes = None
+        return method(self, *vargs, **kwargs)
+
+    wrapped_method.__name__ = method.__name__
+    wrapped_method.__doc__ = method.__doc__
+    return wrapped_method
 
 
 class AddressableList(list):
-    """ List of items addressable either by id or by name """
+    """ List of items addressable either by id or by name
+
+    Lookups by id or title go through hash indexes that are built on the
+    first lookup and rebuilt after the list is modified.
+    """
     def __init__(self, items, name='items'):
         super(AddressableList, self).__init__(items)
         self.name = name
+        self._indexes = None
 
     def __getitem__(self, key):
-        if isinstance(key, int):
+        if isinstance(key, (int, long, slice)):
             return super(AddressableList, self).__getitem__(key)
         else:
-            matches = [item for item in self if item.title == key or item.id == key]
+            matches = self._lookup(key)
             count = len(matches)
             if count > 1:
                 matches = map(repr, matches)
@@ -42,6 +53,42 @@ class AddressableList(list):
                 raise KeyError("Cannot find {key} among the available {name}"
                                .format(key=key, name=self.name))
 
+    def _lookup(self, key):
+        """ Every item whose title or id is key, in list order """
+        if getattr(self, '_indexes', None) is None:
+            self._indexes = self._index()
+        ids, titles = self._indexes
+        try:
+            positions = ids.get(key, []) + titles.get(key, [])
+        except TypeError:
+            # unhashable keys can't match a title or an id
+            return []
+        if len(positions) > 1:
+            positions = sorted(set(positions))
+        return [super(AddressableList, self).__getitem__(position) for position in positions]
+
+    def _index(self):
+        ids = {}
+        titles = {}
+        for position, item in enumerate(self):
+            ids.setdefault(item.id, []).append(position)
+            titles.setdefault(item.title, []).append(position)
+        return ids, titles
+
+    __setitem__ = _invalidates(list.__setitem__)
+    __delitem__ = _invalidates(list.__delitem__)
+    __setslice__ = _invalidates(list.__setslice__)
+    __delslice__ = _invalidates(list.__delslice__)
+    __iadd__ = _invalidates(list.__iadd__)
+    __imul__ = _invalidates(list.__imul__)
+    append = _invalidates(list.append)
+    extend = _invalidates(list.extend)
+    insert = _invalidates(list.insert)
+    pop = _invalidates(list.pop)
+    remove = _invalidates(list.remove)
+    reverse = _invalidates(list.reverse)
+    sort = _invalidates(list.sort)
+
     def _repr_html_(self):
         """ HTML formating for iPython users """
         html = "<table>"
@@ -104,6 +151,70 @@ def affix(prefix, base, suffix, connector='_'):
     return prefix + base + suffix
 
 
+def backoff(interval, maximum=30, minimum=0.1):
+    """ Grow a polling interval by half, to at least `minimum` and at most `maximum` seconds """
+    return max(min(interval * 1.5, maximum), minimum)
+
+
+def ensure_directory(path):
+    """ Create the directory a file goes in, unless the file is in the current directory """
+    directory = os.path.dirname(path)
+    if not directory:
+        return
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class FileLock(object):
+    """
+    Exclusive advisory lock on a file, shared between processes.
+
+    Locking is skipped on platforms without fcntl.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+
+    def __enter__(self):
+        self.fp = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+        self.fp.close()
+        self.fp = None
+
+
+def atomic_write(path, data):
+    """
+    Write data to a file so that readers either see the old or the new
+    contents, never a partially written file.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows won't rename over an existing file
+            os.remove(path)
+            os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def translate(d, mapping):
     d = copy.copy(d)
 
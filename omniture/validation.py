@@ -0,0 +1,169 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import json
+
+from .query import Query
+
+
+# the parts of a report description that `compile` understands
+DATES = ['dateFrom', 'dateTo', 'date', 'dateGranularity']
+REFERENCES = ['metrics', 'elements', 'segments', 'sortBy', 'segment_id']
+OPTIONS = ['reportSuiteID', 'source', 'locale', 'sortMethod', 'anomalyDetection',
+           'currentData', 'expedite', 'elementDataEncoding', 'validate']
+
+
+class ValidationError(ValueError):
+    """
+    Exception raised when one or more report descriptions refer to
+    metrics, elements or segments that don't exist, or are otherwise
+    invalid. Every problem that was found is in `errors`.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        message = "{0} problem(s) with the report description:\n  {1}".format(
+            len(errors), "\n  ".join(errors))
+        super(ValidationError, self).__init__(message)
+
+
+def _description(description):
+    if isinstance(description, basestring):
+        description = json.loads(description)
+    return description.get('reportDescription', description)
+
+
+def _categories(description):
+    """ The kinds of metadata a report description refers to """
+    categories = [category for category in ['metrics', 'elements', 'segments']
+                  if description.get(category)]
+    if description.get('sortBy') and 'metrics' not in categories:
+        categories.append('metrics')
+    if description.get('segment_id') and 'segments' not in categories:
+        categories.append('segments')
+    return categories
+
+
+def _resolve(suite, category, items, errors, label=None):
+    """
+    Look up each metric, element or segment, which is either an id, a title
+    or a dictionary with an id. Errors mention the part of the description
+    as `label`, by default the category and the position of the item.
+    """
+    values = getattr(suite, category)
+    resolved = []
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            key = item.get('id')
+            properties = dict((name, value) for name, value in item.items() if name != 'id')
+        else:
+            key = item
+            properties = {}
+
+        if key is None:
+            # segments can be defined inline instead of by id
+            resolved.append(properties)
+            continue
+        try:
+            value = values[key]
+        except KeyError as error:
+            errors.append("{0}: {1}".format(label or "{0}[{1}]".format(category, index), error.args[0]))
+            continue
+        serialized = dict(value.serialize())
+        serialized.update(properties)
+        resolved.append(serialized)
+    return resolved
+
+
+def compile_report(suite, description, prefetch=True):
+    """
+    Turn a report description into a query in one go, resolving its
+    metrics, elements and segments against the metadata of the suite.
+
+    Unlike building a query one call at a time, every problem with the
+    description is found before giving up: they're raised together as
+    a ValidationError.
+    """
+    description = _description(description)
+    if prefetch:
+        suite.account.prefetch([suite], _categories(description))
+
+    errors = []
+    for key in description:
+        if key not in DATES + REFERENCES + OPTIONS:
+            errors.append("{0}: not a part of a report description".format(key))
+    suite_id = description.get('reportSuiteID')
+    if suite_id is not None and suite_id != suite.id:
+        errors.append("reportSuiteID: the description is for {0}, not {1}".format(suite_id, suite.id))
+
+    query = Query(suite)
+    try:
+        if 'dateFrom' in description:
+            query = query.range(description['dateFrom'], description.get('dateTo'))
+        elif 'date' in description:
+            query = query.range(description['date'])
+        if 'dateGranularity' in description:
+            query = query.granularity(description['dateGranularity'])
+    except (ValueError, OverflowError) as error:
+        errors.append("dates: {0}".format(error))
+
+    raw = query.raw
+    for category in ['metrics', 'elements', 'segments']:
+        if description.get(category):
+            raw[category] = _resolve(suite, category, description[category], errors)
+    if description.get('sortBy'):
+        sort_by = _resolve(suite, 'metrics', [description['sortBy']], errors, 'sortBy')
+        if sort_by:
+            raw['sortBy'] = sort_by[0]['id']
+    if description.get('segment_id'):
+        segment = _resolve(suite, 'segments', [description['segment_id']], errors, 'segment_id')
+        if segment:
+            raw['segment_id'] = segment[0]['id']
+    for key in OPTIONS:
+        if key in description and key != 'reportSuiteID':
+            raw[key] = description[key]
+
+    if errors:
+        raise ValidationError(errors)
+    return query
+
+
+def compile_reports(account, descriptions, max_workers=8):
+    """
+    Compile a list or a dictionary of report descriptions, each with its
+    `reportSuiteID`, into queries. The metadata they need is fetched
+    concurrently up front, and the problems with all of the descriptions
+    are raised together, prefixed by the position or key of the description.
+    """
+    if isinstance(descriptions, dict):
+        items = list(descriptions.items())
+    else:
+        items = list(enumerate(descriptions))
+
+    errors = []
+    jobs = []
+    categories = set()
+    for key, description in items:
+        description = _description(description)
+        try:
+            suite = account.suites[description.get('reportSuiteID')]
+        except KeyError as error:
+            errors.append("{0}: reportSuiteID: {1}".format(key, error.args[0]))
+            continue
+        categories.update(_categories(description))
+        jobs.append((key, suite, description))
+
+    suites = list(set(suite for key, suite, description in jobs))
+    account.prefetch(suites, sorted(categories), max_workers)
+
+    queries = {}
+    for key, suite, description in jobs:
+        try:
+            queries[key] = compile_report(suite, description, prefetch=False)
+        except ValidationError as error:
+            errors.extend("{0}: {1}".format(key, message) for message in error.errors)
+
+    if errors:
+        raise ValidationError(errors)
+    if isinstance(descriptions, dict):
+        return queries
+    return [queries[key] for key, description in items]
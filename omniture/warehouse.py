@@ -0,0 +1,420 @@
+# encoding: utf-8
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import io
+import itertools
+import json
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+from .cache import ResponseCache
+from . import reports
+from . import utils
+
+
+class Download(object):
+    """
+    Fetches the pages of a Data Warehouse report that is ready.
+
+    Up to `workers` pages are requested at once. Pages are handed back in
+    page order no matter which request finishes first, and fetching stops
+    at the first page past the end of the report. Every download keeps
+    track of its own pages, so any number of reports can be downloaded at
+    the same time through one account.
+
+    * workers -- number of pages to fetch concurrently
+    * retries -- how often to retry a page that isn't available yet.
+        Failed requests are retried by the account's RetryPolicy
+    * retry_interval -- seconds to wait before retrying a page
+    * sink -- stream pages to a file or callback instead of keeping them
+        in memory (see `build_sink`)
+    * checkpoint -- path of a manifest that records every page written to
+        the sink, so an interrupted download resumes after the last page
+    """
+    def __init__(self, query, workers=4, retries=30, retry_interval=10, sink=None,
+                 checkpoint=None):
+        self.log = logging.getLogger(__name__)
+        self.query = query
+        self.report_id = query.id
+        self.workers = workers
+        self.retries = retries
+        self.retry_interval = retry_interval
+        self.sink = build_sink(sink)
+        if checkpoint:
+            if not getattr(self.sink, 'resumable', False):
+                raise ValueError("Checkpoints need a CSV file as the sink")
+            self.checkpoint = Checkpoint(checkpoint, query.build())
+            if self.checkpoint.report_id != self.report_id:
+                self.checkpoint.start(self.report_id)
+            self.start = self.checkpoint.next_page
+        else:
+            self.checkpoint = None
+            self.start = 1
+
+    def request(self, page):
+        """ Request a single page of the report """
+        return self.query.suite.request('Report', 'Get', {
+            'reportID': self.report_id,
+            'format': 'csv',
+            'page': page,
+        })
+
+    def fetch(self, page, response=None):
+        """
+        Fetch a page, retrying when needed. Returns None past the last page.
+
+        Pass the response if the page has already been requested once.
+        """
+        attempt = 0
+        while True:
+            attempt = attempt + 1
+            # connection failures are retried by the account's RetryPolicy
+            if response is None:
+                response = self.request(page)
+
+            if response.status_code != 400:
+                return response
+
+            error = json.loads(response.content)
+            if error['error'] == 'eof_or_invalid_page':
+                return None
+            elif error['error'] == 'no_warehouse_data' and attempt <= self.retries:
+                self.log.debug("Page %s isn't available yet, retrying", page)
+                time.sleep(self.retry_interval)
+                response = None
+            else:
+                raise reports.InvalidReportError(error)
+
+    def pages(self, start=1):
+        """ Yield (page number, response) pairs in page order, starting at `start` """
+        pool = ThreadPool(self.workers)
+        try:
+            pending = collections.deque()
+            page = start
+            for _ in range(self.workers):
+                pending.append((page, pool.apply_async(self.fetch, (page,))))
+                page = page + 1
+
+            while pending:
+                number, result = pending.popleft()
+                response = result.get()
+                if response is None:
+                    break
+                pending.append((page, pool.apply_async(self.fetch, (page,))))
+                page = page + 1
+                yield number, response
+        finally:
+            pool.terminate()
+
+    def collect(self, first):
+        """
+        Download every page after the first one requested.
+
+        Returns the whole report as one DataFrame, or whatever the sink
+        returns when it is closed if the pages are streamed to a sink.
+        """
+        if self.sink:
+            return self.stream(first)
+
+        import pandas as pd
+
+        first = self.fetch(self.start, first)
+        if first is None:
+            # the report has no rows at all
+            return pd.DataFrame()
+        frames = [read_page(first.content)]
+        total_row_count = len(frames[0])
+        for number, response in self.pages(self.start + 1):
+            frame = read_page(response.content)
+            total_row_count = total_row_count + len(frame)
+            self.log.info("Downloaded page %s of report %s, %s rows so far",
+                          number, self.report_id, total_row_count)
+            frames.append(frame)
+
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def stream(self, first):
+        """ Hand every page to the sink as soon as it is its turn """
+        if self.checkpoint:
+            offset = self.checkpoint.offset
+            if self.checkpoint.pages:
+                self.log.info("Resuming report %s from page %s", self.report_id, self.start)
+                last = self.checkpoint.pages[-1]
+                if not self.sink.verify(last['offset'], last['length'], last['sha1']):
+                    raise ValueError("The data already downloaded for report {} doesn't "
+                                     "match the checkpoint {}".format(self.report_id,
+                                                                     self.checkpoint.path))
+        else:
+            offset = 0
+
+        self.sink.open(offset)
+        try:
+            first = self.fetch(self.start, first)
+            if first is None:
+                pages = iter([])
+            else:
+                pages = itertools.chain([(self.start, first)], self.pages(self.start + 1))
+
+            for number, response in pages:
+                written = self.sink.write(number, response.content)
+                if self.checkpoint:
+                    self.checkpoint.record(number, offset, written)
+                offset = offset + len(written)
+                self.log.info("Wrote page %s of report %s", number, self.report_id)
+        finally:
+            result = self.sink.close()
+
+        if self.checkpoint:
+            self.checkpoint.finish()
+        return result
+
+
+class Checkpoint(object):
+    """
+    Manifest of a download that is streamed to a sink.
+
+    It records the report ID and, for every page written so far, its byte
+    offset and length in the sink and a checksum, so that a download that
+    was interrupted can pick up after the last complete page. The manifest
+    is tied to the report description and is ignored once it's complete.
+    """
+    def __init__(self, path, description):
+        self.path = path
+        self.description = ResponseCache.key(description)
+        self.report_id = None
+        self.pages = []
+        self.complete = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as fp:
+                manifest = json.load(fp)
+        except (IOError, ValueError):
+            return
+
+        if manifest.get('description') != self.description or manifest.get('complete'):
+            return
+        self.report_id = manifest['reportID']
+        self.pages = manifest['pages']
+
+    def save(self):
+        utils.atomic_write(self.path, json.dumps({
+            'reportID': self.report_id,
+            'description': self.description,
+            'pages': self.pages,
+            'complete': self.complete,
+        }, indent=4))
+
+    def start(self, report_id):
+        """ Start over for a newly queued report """
+        self.report_id = report_id
+        self.pages = []
+        self.complete = False
+        self.save()
+
+    def record(self, page, offset, data):
+        self.pages.append({
+            'page': page,
+            'offset': offset,
+            'length': len(data),
+            'sha1': hashlib.sha1(data).hexdigest(),
+        })
+        self.save()
+
+    def finish(self):
+        self.complete = True
+        self.save()
+
+    @property
+    def next_page(self):
+        if self.pages:
+            return self.pages[-1]['page'] + 1
+        return 1
+
+    @property
+    def offset(self):
+        """ Where the next page goes in the sink """
+        if self.pages:
+            return self.pages[-1]['offset'] + self.pages[-1]['length']
+        return 0
+
+
+def read_page(content):
+    """ Parse a page of CSV into a DataFrame """
+    import pandas as pd
+    return pd.read_csv(io.BytesIO(content))
+
+
+def build_sink(target):
+    """
+    Turn a sink specification into a sink:
+
+    * None -- no sink, pages are kept in memory
+    * a path ending in .parquet -- ParquetSink
+    * any other path -- CSVSink
+    * a function -- CallbackSink
+    * anything else is assumed to be a sink already
+    """
+    if target is None:
+        return None
+    elif isinstance(target, basestring):
+        if target.endswith('.parquet'):
+            return ParquetSink(target)
+        return CSVSink(target)
+    elif callable(target):
+        return CallbackSink(target)
+    else:
+        return target
+
+
+class CSVSink(object):
+    """
+    Appends the pages of a report to a single CSV file, as they come in.
+    The header is only written once.
+    """
+    resumable = True
+
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+
+    def open(self, offset=0):
+        """ Start writing at offset, dropping anything after it """
+        if offset:
+            self.fp = open(self.path, 'r+b')
+            self.fp.truncate(offset)
+            self.fp.seek(offset)
+        else:
+            self.fp = open(self.path, 'wb')
+
+    def verify(self, offset, length, checksum):
+        """ Whether the file holds the data recorded in a checkpoint """
+        try:
+            with open(self.path, 'rb') as fp:
+                fp.seek(offset)
+                data = fp.read(length)
+        except IOError:
+            return False
+        return len(data) == length and hashlib.sha1(data).hexdigest() == checksum
+
+    def write(self, number, content):
+        """ Write a page and return what was written """
+        if number > 1:
+            # every page repeats the header
+            content = content.split('\n', 1)[1] if '\n' in content else ''
+        if content and not content.endswith('\n'):
+            content = content + '\n'
+        self.fp.write(content)
+        self.fp.flush()
+        return content
+
+    def close(self):
+        self.fp.close()
+        return self.path
+
+
+class ParquetSink(object):
+    """
+    Writes the pages of a report to a Parquet file, one row group per page.
+    Requires pyarrow. Parquet files can't be appended to, so these downloads
+    can't be resumed.
+
+    The columns of the file are typed after the first page, and every later
+    page is converted to those types. Integer columns are written as
+    doubles and empty columns as strings, since a later page may have
+    gaps or values where the first page had none.
+    """
+    resumable = False
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.schema = None
+
+    def open(self, offset=0):
+        self.writer = None
+        self.schema = None
+
+    def write(self, number, content):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow: pip install omniture[parquet]")
+
+        frame = read_page(content)
+        if self.writer is None:
+            empty = [column for column in frame if frame[column].isnull().all()]
+            self.schema = _widen(pa.Table.from_pandas(frame, preserve_index=False).schema, empty)
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(self._conform(frame))
+        return content
+
+    def verify(self, offset, length, checksum):
+        """ Parquet files can't be checked page by page """
+        return False
+
+    def _conform(self, frame):
+        """ A table of the page with the column types of the file """
+        import pyarrow as pa
+
+        for field in self.schema:
+            column = frame[field.name]
+            if pa.types.is_string(field.type):
+                frame[field.name] = column.where(column.isnull(), column.astype(str))
+            elif pa.types.is_floating(field.type):
+                frame[field.name] = column.astype('float64')
+        return pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        return self.path
+
+
+def _widen(schema, empty=()):
+    """ Column types that every page of a report can be converted to """
+    import pyarrow as pa
+
+    fields = []
+    for field in schema:
+        if pa.types.is_null(field.type) or field.name in empty:
+            field = pa.field(field.name, pa.string())
+        elif pa.types.is_integer(field.type):
+            field = pa.field(field.name, pa.float64())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+class CallbackSink(object):
+    """
+    Calls `fn(page number, DataFrame)` for every page, in page order.
+    Returns the number of rows handed to the function. There's no telling
+    what the function did with the pages it was handed, so these downloads
+    can't be resumed.
+    """
+    resumable = False
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.rows = 0
+
+    def open(self, offset=0):
+        self.rows = 0
+
+    def verify(self, offset, length, checksum):
+        """ Pages handed to a function can't be checked """
+        return False
+
+    def write(self, number, content):
+        frame = read_page(content)
+        self.rows = self.rows + len(frame)
+        self.fn(number, frame)
+        return content
+
+    def close(self):
+        return self.rows
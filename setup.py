@@ -12,6 +12,9 @@ setup(name='omniture',
             'requests',
             'python-dateutil',
       ],
+      extras_require={
+            'parquet': ['pandas', 'pyarrow'],
+      },
       classifiers=['Development Status :: 4 - Beta',
                    'Intended Audience :: Developers',
                    'License :: OSI Approved :: MIT License',
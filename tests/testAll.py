@@ -2,6 +2,18 @@ import unittest
 from testaccountUnit import AccountUnitTest
 from testQuery import QueryTest
 from testReports import ReportTest
+from testScheduler import SchedulerTest
+from testCache import CacheTest
+from testUtils import AddressableListTest, ValueTest
+from testReportData import ReportDataTest
+from testWarehouse import WarehouseTest
+from testPolling import PollingTest
+from testRateLimit import RateLimitTest
+from testRetry import RetryTest
+from testBatch import BatchTest
+from testClone import CloneTest
+from testSnapshot import SnapshotTest
+from testValidation import ValidationTest
 import sys
 
 
@@ -12,6 +24,19 @@ def test_suite():
     test_suite.addTest(unittest.makeSuite(AccountUnitTest))
     test_suite.addTest(unittest.makeSuite(QueryTest))
     test_suite.addTest(unittest.makeSuite(ReportTest))
+    test_suite.addTest(unittest.makeSuite(SchedulerTest))
+    test_suite.addTest(unittest.makeSuite(CacheTest))
+    test_suite.addTest(unittest.makeSuite(AddressableListTest))
+    test_suite.addTest(unittest.makeSuite(ValueTest))
+    test_suite.addTest(unittest.makeSuite(ReportDataTest))
+    test_suite.addTest(unittest.makeSuite(WarehouseTest))
+    test_suite.addTest(unittest.makeSuite(PollingTest))
+    test_suite.addTest(unittest.makeSuite(RateLimitTest))
+    test_suite.addTest(unittest.makeSuite(RetryTest))
+    test_suite.addTest(unittest.makeSuite(BatchTest))
+    test_suite.addTest(unittest.makeSuite(CloneTest))
+    test_suite.addTest(unittest.makeSuite(SnapshotTest))
+    test_suite.addTest(unittest.makeSuite(ValidationTest))
 
     return test_suite
 
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import threading
+import time
+
+
+class FakeQuery(object):
+    """ Stands in for a Query, failing to queue when asked to """
+    def __init__(self, id, fail=False, delay=0):
+        self.id = None
+        self.report_id = id
+        self.fail = fail
+        self.delay = delay
+
+    def queue(self):
+        time.sleep(self.delay)
+        if self.fail:
+            raise omniture.InvalidReportError({'error': 'metric_not_valid'})
+        self.id = self.report_id
+        return self
+
+    def check(self):
+        return "report {}".format(self.id)
+
+
+class BatchTest(unittest.TestCase):
+    def test_report_ids(self):
+        batch = omniture.submit({'a': FakeQuery(1), 'b': FakeQuery(2)})
+        self.assertEqual(batch.report_ids, {'a': 1, 'b': 2})
+        self.assertEqual(batch.latency()['count'], 2)
+        self.assertEqual(batch.failures, [])
+
+    def test_failures(self):
+        """ A report that can't be queued doesn't stop the others """
+        batch = omniture.submit([FakeQuery(1), FakeQuery(2, fail=True), FakeQuery(3)])
+        self.assertEqual(batch.report_ids, {0: 1, 2: 3})
+        self.assertEqual([submission.key for submission in batch.failures], [1])
+        self.assertIsInstance(batch[1].error, omniture.InvalidReportError)
+        self.assertRaises(omniture.InvalidReportError, batch.raise_for_failures)
+
+    def test_backpressure(self):
+        """ Queries are only taken from a generator as fast as they are queued """
+        counts = {'taken': 0, 'most': 0}
+        queued = []
+        lock = threading.Lock()
+
+        def queries():
+            for id in range(20):
+                with lock:
+                    counts['taken'] += 1
+                    counts['most'] = max(counts['most'], counts['taken'] - len(queued))
+                query = FakeQuery(id, delay=0.005)
+                query.queue = lambda query=query: queued.append(FakeQuery.queue(query))
+                yield query
+
+        batch = omniture.submit(queries(), max_workers=2, max_pending=3)
+        self.assertEqual(len(batch.report_ids), 20)
+        # three waiting to be queued and one waiting for a slot
+        self.assertTrue(counts['most'] <= 4)
+
+    def test_queue(self):
+        """ queue returns the queries it was given and raises when one can't be queued """
+        queries = omniture.queue({'a': FakeQuery(1), 'b': FakeQuery(2)})
+        self.assertEqual(dict((key, query.id) for key, query in queries.items()), {'a': 1, 'b': 2})
+        self.assertEqual([query.id for query in omniture.queue([FakeQuery(3), FakeQuery(4)])], [3, 4])
+
+        queries = [FakeQuery(5), FakeQuery(6, fail=True), FakeQuery(7)]
+        self.assertRaises(omniture.InvalidReportError, omniture.queue, queries)
+        self.assertEqual(queries[2].id, 7)
+
+    def test_sync_reports_queue_errors(self):
+        self.assertRaises(omniture.InvalidReportError, omniture.sync,
+                          [FakeQuery(1), FakeQuery(2, fail=True)], interval=0.01)
+
+if __name__ == '__main__':
+    unittest.main()
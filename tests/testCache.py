@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import json
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import requests_mock
+
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'}]})
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_key_is_canonical(self):
+        """ The order of keys in a query doesn't change the cache key """
+        key = omniture.ResponseCache.key
+        self.assertEqual(key('Report', 'Get', {'a': 1, 'b': 2}), key('Report', 'Get', {'b': 2, 'a': 1}))
+        self.assertNotEqual(key('Report', 'Get', {'a': 1}), key('Report', 'GetMetrics', {'a': 1}))
+
+    def test_get_set(self):
+        cache = omniture.ResponseCache(self.path)
+        self.assertIsNone(cache.get('missing'))
+        cache.set('key', {'metrics': [1, 2]})
+        self.assertEqual(cache.get('key'), {'metrics': [1, 2]})
+
+    def test_ttl(self):
+        cache = omniture.ResponseCache(self.path, ttl=0)
+        cache.set('key', 'value')
+        time.sleep(0.01)
+        self.assertIsNone(cache.get('key'))
+
+    def test_eviction(self):
+        """ The least recently used entries are dropped once the cache is full """
+        cache = omniture.ResponseCache(self.path, max_size=200)
+        cache.set('old', 'x' * 50)
+        time.sleep(0.01)
+        cache.set('new', 'x' * 50)
+        time.sleep(0.01)
+        cache.set('newest', 'x' * 50)
+        self.assertIsNone(cache.get('old'))
+        self.assertEqual(cache.get('newest'), 'x' * 50)
+
+    @requests_mock.mock()
+    def test_account_request_cached(self, m):
+        """ A cached request only hits the API once """
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        analytics = omniture.authenticate('username', 'secret', cache=self.path)
+        analytics.request_cached('Company', 'GetReportSuites')
+        self.assertEqual(m.call_count, 1)
+
+        analytics = omniture.authenticate('username', 'secret', cache=self.path)
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(analytics.suites[0].id, 'omniture.api-gateway')
+
+    def test_report_cache_policy(self):
+        """ Only closed date ranges without currentData are cached """
+        cache = omniture.ReportCache(self.path)
+        today = datetime.date.today()
+        self.assertTrue(cache.cacheable({'dateFrom': '2015-06-01', 'dateTo': '2015-06-02'}))
+        self.assertFalse(cache.cacheable({'dateFrom': '2015-06-01', 'dateTo': today.isoformat()}))
+        self.assertFalse(cache.cacheable({'dateFrom': '2015-06-01', 'dateTo': '2015-06-02', 'currentData': True}))
+        self.assertFalse(cache.cacheable({'dateFrom': '2015-06-01'}))
+
+    @requests_mock.mock()
+    def test_cached_report(self, m):
+        """ A cached report is returned without queueing it """
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        analytics = omniture.authenticate('username', 'secret', report_cache=self.path)
+        query = analytics.suites[0].report.range('2015-06-01', '2015-06-02')\
+            .metric('pageviews', disable_validation=True)
+        with open(os.path.dirname(os.path.abspath(__file__)) + '/mock_objects/Report.Get.json') as data_file:
+            response = json.load(data_file)
+        analytics.report_cache.set_report(query.build()['reportDescription'], response)
+
+        report = omniture.sync([query])[0]
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(report.metrics[0].id, 'pageviews')
+
+if __name__ == '__main__':
+    unittest.main()
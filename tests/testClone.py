@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+from omniture import utils
+
+
+class FakeSuite(object):
+    id = 'omniture.api-gateway'
+    account = None
+
+    def __init__(self):
+        self.metrics = utils.AddressableList([omniture.Value('Page Views', 'pageviews', self)], 'metrics')
+        self.elements = utils.AddressableList([omniture.Element('Page', 'page', self)], 'elements')
+        self.segments = utils.AddressableList([omniture.Segment('Mobile', 'mobile', self)], 'segments')
+
+
+class CloneTest(unittest.TestCase):
+    def setUp(self):
+        self.suite = FakeSuite()
+        self.query = omniture.Query(self.suite).element('page').metric('pageviews').filter('mobile')
+
+    def test_derived_queries_dont_change_their_parent(self):
+        self.query.element('browser', disable_validation=True)
+        self.query.metric('visits', disable_validation=True)
+        self.query.filter(segment='tablet', disable_validation=True)
+        self.assertEqual(self.query.raw['elements'], [{'id': 'page'}])
+        self.assertEqual(self.query.raw['metrics'], [{'id': 'pageviews'}])
+        self.assertEqual(self.query.raw['segments'], [{'id': 'mobile'}])
+
+    def test_siblings_dont_share_lists(self):
+        first = self.query.element('browser', disable_validation=True)
+        second = self.query.element('os', disable_validation=True)
+        self.assertEqual([e['id'] for e in first.raw['elements']], ['page', 'browser'])
+        self.assertEqual([e['id'] for e in second.raw['elements']], ['page', 'os'])
+
+    def test_values_arent_changed(self):
+        """ Options on an element don't end up on the suite's element """
+        self.query.element('page', top=10)
+        self.assertEqual(self.suite.elements['page'].serialize(), {'id': 'page'})
+        self.assertIsNot(self.query.raw['metrics'][0], self.suite.metrics['pageviews'].serialize())
+
+    def test_clone_is_a_fresh_query(self):
+        self.query.id = 123
+        query = self.query.granularity('day').download(workers=2)
+        self.assertIsNone(query.id)
+        self.assertEqual(query.raw['dateGranularity'], 'day')
+        self.assertEqual(query.download_options['workers'], 2)
+        self.assertEqual(self.query.download_options, {})
+
+if __name__ == '__main__':
+    unittest.main()
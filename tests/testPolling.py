@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import os
+import json
+import shutil
+import tempfile
+import itertools
+import requests_mock
+
+path = os.path.dirname(os.path.abspath(__file__))
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'}]})
+
+
+class FakeSuite(object):
+    id = 'omniture.api-gateway'
+    account = None
+
+
+def waits(polling, query, count=4):
+    return list(itertools.islice(polling.intervals(query, 1), count))
+
+
+class PollingTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.timings = os.path.join(self.path, 'timings.json')
+        self.query = omniture.Query(FakeSuite()).range('2015-06-01', '2015-06-07')\
+            .element('page', disable_validation=True)\
+            .metric('pageviews', disable_validation=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_backoff(self):
+        self.assertEqual(waits(omniture.Backoff(), self.query), [1, 1.5, 2.25, 3.375])
+        self.assertEqual(waits(omniture.Backoff(maximum=2), self.query), [1, 1.5, 2, 2])
+
+    def test_backoff_small_intervals(self):
+        """ Short intervals grow instead of rounding down to a busy loop """
+        self.assertEqual(omniture.utils.backoff(0), 0.1)
+        self.assertEqual(omniture.utils.backoff(0.2), 0.2 * 1.5)
+        self.assertEqual(omniture.utils.backoff(0.5), 0.75)
+
+    def test_unknown_shape_backs_off(self):
+        polling = omniture.AdaptivePolling(self.timings)
+        self.assertEqual(waits(polling, self.query), [1, 1.5, 2.25, 3.375])
+
+    def test_adaptive(self):
+        """ The first check comes shortly before the report is expected to be ready """
+        polling = omniture.AdaptivePolling(self.timings)
+        polling.record(self.query, 20)
+        self.assertEqual(waits(polling, self.query), [16, 2, 2, 2])
+
+    def test_other_shapes_are_kept_apart(self):
+        polling = omniture.AdaptivePolling(self.timings)
+        polling.record(self.query, 20)
+        other = self.query.range('2015-01-01', '2015-06-30')
+        self.assertIsNone(polling.expected(other))
+        self.assertEqual(polling.expected(self.query.range('2015-06-08', '2015-06-14')), 20)
+
+    def test_timings_are_shared(self):
+        """ Timings are averaged and kept on disk """
+        omniture.AdaptivePolling(self.timings).record(self.query, 10)
+        omniture.AdaptivePolling(self.timings).record(self.query, 20)
+        polling = omniture.AdaptivePolling(self.timings)
+        self.assertEqual(polling.expected(self.query), 13)
+        self.assertEqual(polling.timings.values()[0]['count'], 2)
+
+    def test_bare_filename(self):
+        """ Timings can be kept in a file in the current directory """
+        cwd = os.getcwd()
+        os.chdir(self.path)
+        try:
+            omniture.AdaptivePolling('latency.json').record(self.query, 20)
+            self.assertEqual(omniture.AdaptivePolling('latency.json').expected(self.query), 20)
+        finally:
+            os.chdir(cwd)
+
+    @requests_mock.mock()
+    def test_sync_records_timing(self, m):
+        with open(path + '/mock_objects/Report.Get.json') as data_file:
+            response = data_file.read()
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        m.post(ENDPOINT + '?method=Report.Queue', text='{"reportID": 123456789}')
+        m.post(ENDPOINT + '?method=Report.Get', [
+            {'text': '{"error": "report_not_ready"}'},
+            {'text': response},
+        ])
+
+        analytics = omniture.authenticate('username', 'secret', polling=self.timings)
+        query = analytics.suites[0].report.element('page', disable_validation=True)\
+            .metric('pageviews', disable_validation=True).granularity('day')
+        query.sync(interval=0)
+        self.assertEqual(len(analytics.polling.timings), 1)
+        self.assertIsNotNone(analytics.polling.expected(query))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import os
+import json
+import shutil
+import tempfile
+import time
+import requests_mock
+from omniture import ratelimit
+
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'}]})
+
+
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_burst(self):
+        """ A full bucket lets a burst through, after that requests wait their turn """
+        bucket = ratelimit.TokenBucket(50, burst=3)
+        start = time.time()
+        for _ in range(3):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertTrue(bucket.acquire() > 0)
+        self.assertTrue(time.time() - start >= 0.015)
+
+    def test_most_specific_limit(self):
+        limiter = omniture.RateLimiter({'Report.Queue': 1, 'Report': 5}, default=10)
+        self.assertEqual(limiter.bucket('Report', 'Queue').rate, 1)
+        self.assertEqual(limiter.bucket('Report', 'Get').rate, 5)
+        self.assertEqual(limiter.bucket('Company', 'GetReportSuites').rate, 10)
+        self.assertIsNone(omniture.RateLimiter({'Report': 5}).bucket('Segments', 'Get'))
+
+    def test_shared(self):
+        """ Limiters using the same file share one budget """
+        path = os.path.join(self.path, 'ratelimit.json')
+        first = omniture.RateLimiter({'Report.Get': (1, 2)}, path=path)
+        second = omniture.RateLimiter({'Report.Get': (1, 2)}, path=path)
+        first.acquire('Report', 'Get')
+        second.acquire('Report', 'Get')
+        self.assertTrue(first.bucket('Report', 'Get').acquire() > 0)
+
+    def test_bare_filename(self):
+        cwd = os.getcwd()
+        os.chdir(self.path)
+        try:
+            limiter = omniture.RateLimiter({'Report.Get': 10}, path='ratelimit.json')
+            limiter.acquire('Report', 'Get')
+            self.assertTrue(os.path.exists(os.path.join(self.path, 'ratelimit.json')))
+        finally:
+            os.chdir(cwd)
+
+    @requests_mock.mock()
+    def test_account(self, m):
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        analytics = omniture.authenticate('username', 'secret',
+                                          rate_limit={'Company': (1, 1)})
+        self.assertTrue(analytics.rate_limit.bucket('Company', 'GetReportSuites').tokens < 1)
+
+if __name__ == '__main__':
+    unittest.main()
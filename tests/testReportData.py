@@ -0,0 +1,194 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import os
+import json
+import datetime
+import numpy
+import requests_mock
+
+path = os.path.dirname(os.path.abspath(__file__))
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'}]})
+
+
+class FakeSuite(object):
+    id = 'omniture.api-gateway'
+    segments = []
+
+
+def load_report(name):
+    with open(path + '/mock_objects/' + name) as data_file:
+        raw = json.load(data_file)
+    return omniture.Report(raw, omniture.Query(FakeSuite()))
+
+
+class ReportDataTest(unittest.TestCase):
+    def test_trended_rows(self):
+        """ Every breakdown row becomes a record with the date, element and metrics """
+        report = load_report('Report.Get.json')
+        self.assertEqual(len(report.data), 4)
+        self.assertEqual(report.data[0], {
+            'datetime': datetime.datetime(2015, 6, 1),
+            'datetime_friendly': 'Mon. 1 Jun. 2015',
+            'page': 'home',
+            'pageviews': 120,
+            'bouncerate': 40.5,
+        })
+        self.assertIsInstance(report.data[3]['bouncerate'], float)
+
+    def test_columns(self):
+        report = load_report('Report.Get.json')
+        columns = report.to_columns()
+        self.assertEqual(list(columns), ['datetime', 'datetime_friendly', 'page', 'pageviews', 'bouncerate'])
+        self.assertEqual(columns['page'], ['home', 'about', 'home', 'contact'])
+        self.assertEqual(columns['pageviews'], [120, 15, 98, 7])
+
+    def test_classifications(self):
+        """ Classifications of the same element get their own column """
+        report = load_report('multi_classifications.json')
+        self.assertEqual(report.data[1]['evar2 | Classification 1'], '::unspecified::')
+        self.assertEqual(report.data[1]['evar2 | Classification 2'], 'Test')
+
+    def test_dataframe(self):
+        """ The DataFrame has typed columns and doesn't need the list of dicts """
+        report = load_report('Report.Get.json')
+        frame = report.dataframe
+        self.assertEqual(list(frame.columns), ['datetime', 'datetime_friendly', 'page', 'pageviews', 'bouncerate'])
+        self.assertEqual(frame['pageviews'].dtype, numpy.int64)
+        self.assertEqual(frame['bouncerate'].dtype, numpy.float64)
+        self.assertEqual(frame['datetime'].dtype, numpy.dtype('datetime64[ns]'))
+        self.assertEqual(frame['page'].dtype.name, 'category')
+        self.assertEqual(list(frame['page']), ['home', 'about', 'home', 'contact'])
+        self.assertIsNone(report.dict_data)
+
+    def test_iter_rows(self):
+        """ Iterating over a report gives the same rows as report.data """
+        report = load_report('Report.Get.json')
+        self.assertEqual(list(report), report.data)
+        batches = list(report.iter_rows(batch_size=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+        self.assertEqual(batches[1][0]['page'], 'contact')
+
+    @requests_mock.mock()
+    def test_run(self, m):
+        """ Regular reports are fetched as JSON """
+        with open(path + '/mock_objects/Report.Get.json') as data_file:
+            response = data_file.read()
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        m.post(ENDPOINT + '?method=Report.Queue', text='{"reportID": 123456789}')
+        m.post(ENDPOINT + '?method=Report.Get', text=response)
+
+        analytics = omniture.authenticate('username', 'secret')
+        report = analytics.suites[0].report.element('page', disable_validation=True)\
+            .metric('pageviews', disable_validation=True).granularity('day').sync(interval=0)
+        self.assertEqual(m.last_request.json(), {'reportID': 123456789})
+        self.assertEqual(report.timing['execution'], 1.25)
+        self.assertEqual(len(report.data), 4)
+
+    @requests_mock.mock()
+    def test_split(self, m):
+        """ A report split into chunks comes back as one report, without duplicated days """
+        with open(path + '/mock_objects/Report.Get.json') as data_file:
+            fixture = json.load(data_file)
+
+        def queue(request, context):
+            return json.dumps({'reportID': int(request.json()['reportDescription']['dateFrom'][-2:])})
+
+        def get(request, context):
+            response = json.loads(json.dumps(fixture))
+            first_day = request.json()['reportID']
+            # the second chunk overlaps the first by a day
+            for offset, row in enumerate(response['report']['data']):
+                row['day'] = first_day + offset - (1 if first_day > 1 else 0)
+                row['breakdownTotal'] = [str(100 * row['day']), '31.71']
+            return json.dumps(response)
+
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        m.post(ENDPOINT + '?method=Report.Queue', text=queue)
+        m.post(ENDPOINT + '?method=Report.Get', text=get)
+
+        analytics = omniture.authenticate('username', 'secret')
+        query = analytics.suites[0].report.element('page', disable_validation=True)\
+            .metric('pageviews', disable_validation=True)\
+            .range('2015-06-01', '2015-06-04', granularity='day', split=2)
+        self.assertEqual([chunk.raw['dateTo'] for chunk in query.chunks()], ['2015-06-02', '2015-06-04'])
+
+        report = query.sync(interval=0)
+        days = [row['datetime'].day for row in report.data]
+        self.assertEqual(days, [1, 1, 2, 2, 3, 3])
+        # totals are added up over the days that were kept, for additive metrics only
+        self.assertEqual(report.report['totals'], ['600', None])
+        self.assertEqual(report.timing['execution'], 2.5)
+
+        # the same through the batch functions, which queue the chunks up front
+        for report in omniture.sync([query, query.range('2015-06-01', '2015-06-04', granularity='day',
+                                                        split=2, split_workers=1)], interval=0):
+            self.assertEqual([row['datetime'].day for row in report.data], [1, 1, 2, 2, 3, 3])
+            self.assertEqual(report.report['totals'], ['600', None])
+        queued = omniture.queue([query])[0]
+        self.assertEqual(queued.id, (1, 3))
+        self.assertEqual(queued.sync(interval=0, max_workers=1).report['totals'], ['600', None])
+
+    @requests_mock.mock()
+    def test_split_queue_failure(self, m):
+        """ When a chunk can't be queued, the chunks that were are cancelled """
+        def queue(request, context):
+            first_day = int(request.json()['reportDescription']['dateFrom'][-2:])
+            if first_day > 1:
+                return json.dumps({'error': 'metric_id_invalid', 'error_description': 'Invalid metric'})
+            return json.dumps({'reportID': first_day})
+
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        m.post(ENDPOINT + '?method=Report.Queue', text=queue)
+        m.post(ENDPOINT + '?method=Report.CancelReport', text='true')
+
+        analytics = omniture.authenticate('username', 'secret')
+        query = analytics.suites[0].report.element('page', disable_validation=True)\
+            .metric('pageviews', disable_validation=True)\
+            .range('2015-06-01', '2015-06-04', granularity='day', split=2, split_workers=1)
+        self.assertRaises(omniture.InvalidReportError, query.queue)
+        cancelled = [request.json() for request in m.request_history if 'CancelReport' in request.url]
+        self.assertEqual(cancelled, [{'reportID': 1}])
+        self.assertIsNone(query.parts)
+
+    @requests_mock.mock()
+    def test_iter_pages(self, m):
+        """ Every value of an element is paged through, in order """
+        values = 25
+
+        def queue(request, context):
+            element = request.json()['reportDescription']['elements'][0]
+            return json.dumps({'reportID': int(element['startingWith'])})
+
+        def get(request, context):
+            start = request.json()['reportID']
+            rows = [{'name': 'page {}'.format(value), 'counts': [str(value)]}
+                    for value in range(start, min(start + 10, values + 1))]
+            return json.dumps({'report': {
+                'type': 'ranked', 'data': rows, 'period': 'Mon. 1 Jun. 2015',
+                'elements': [{'id': 'page', 'name': 'Page'}],
+                'metrics': [{'id': 'pageviews', 'name': 'Page Views', 'decimals': 0}],
+                'totals': ['0'],
+            }, 'waitSeconds': 0, 'runSeconds': 0})
+
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        m.post(ENDPOINT + '?method=Report.Queue', text=queue)
+        m.post(ENDPOINT + '?method=Report.Get', text=get)
+        m.post(ENDPOINT + '?method=Report.CancelReport', text='true')
+
+        analytics = omniture.authenticate('username', 'secret')
+        query = analytics.suites[0].report.element('page', disable_validation=True)\
+            .metric('pageviews', disable_validation=True).range('2015-06-01')
+        rows = list(query.iter_rows(top=10, max_workers=2, interval=0))
+        self.assertEqual([row['pageviews'] for row in rows], range(1, values + 1))
+        self.assertEqual(len(query.raw['elements'][0]), 1)
+
+    def test_split_requires_granularity(self):
+        query = omniture.Query(FakeSuite()).range('2015-06-01', '2015-06-30', split=7)
+        self.assertRaises(ValueError, query.chunks)
+        self.assertRaises(ValueError, query.granularity('month').chunks)
+
+if __name__ == '__main__':
+    unittest.main()
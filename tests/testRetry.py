@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import json
+import requests
+import requests_mock
+
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'}]})
+
+
+class RetryTest(unittest.TestCase):
+    def authenticate(self, m, **kwargs):
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        retry = omniture.RetryPolicy(backoff=0, **kwargs)
+        return omniture.authenticate('username', 'secret', retry=retry)
+
+    @requests_mock.mock()
+    def test_server_errors(self, m):
+        """ 5xx responses are retried """
+        m.post(ENDPOINT + '?method=Company.GetReportSuites', [
+            {'status_code': 503, 'text': ''},
+            {'text': SUITES},
+        ])
+        analytics = omniture.authenticate('username', 'secret', retry=omniture.RetryPolicy(backoff=0))
+        self.assertEqual(len(analytics.suites), 1)
+        self.assertEqual(analytics.retry.stats()['Company.GetReportSuites'],
+                         {'requests': 2, 'retries': 1})
+
+    @requests_mock.mock()
+    def test_budget(self, m):
+        analytics = self.authenticate(m, budgets={'Report.Get': 2})
+        m.post(ENDPOINT + '?method=Report.Get', exc=requests.exceptions.ConnectionError)
+        self.assertRaises(requests.ConnectionError, analytics.request, 'Report', 'Get', {'reportID': 1})
+        self.assertEqual(analytics.retry.stats()['Report.Get'],
+                         {'requests': 3, 'retries': 2, 'failures': 1})
+
+    @requests_mock.mock()
+    def test_queue_is_not_duplicated(self, m):
+        """ A queue request that may have reached Adobe isn't sent again """
+        analytics = self.authenticate(m)
+        m.post(ENDPOINT + '?method=Report.Queue', exc=requests.exceptions.ReadTimeout)
+        self.assertRaises(requests.Timeout, analytics.request, 'Report', 'Queue', {})
+        self.assertEqual(analytics.retry.stats()['Report.Queue']['requests'], 1)
+
+    @requests_mock.mock()
+    def test_queue_retried_when_not_sent(self, m):
+        analytics = self.authenticate(m)
+        m.post(ENDPOINT + '?method=Report.Queue', [
+            {'exc': requests.exceptions.ConnectTimeout},
+            {'text': '{"reportID": 123456789}'},
+        ])
+        self.assertEqual(analytics.request('Report', 'Queue', {}), {'reportID': 123456789})
+        self.assertEqual(analytics.retry.stats()['total']['retries'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+from omniture import polling, scheduler
+
+
+class FakeQuery(object):
+    """ Stands in for a Query that is ready after a number of checks """
+    def __init__(self, checks):
+        self.id = checks
+        self.checks = checks
+
+    def queue(self):
+        return self
+
+    def intervals(self, interval):
+        return polling.Backoff().intervals(self, interval)
+
+    def check(self):
+        self.checks -= 1
+        if self.checks > 0:
+            return None
+        return "report {}".format(self.id)
+
+
+class FakeSuite(object):
+    id = 'omniture.api-gateway'
+    account = None
+
+
+class BrokenQuery(FakeQuery):
+    def check(self):
+        raise omniture.InvalidReportError({'error': 'report_not_valid'})
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_sync_list_keeps_order(self):
+        """ Reports come back in the order they were given, not the order they finished """
+        queries = [FakeQuery(3), FakeQuery(1), FakeQuery(2)]
+        response = omniture.sync(queries, interval=0.01)
+        self.assertEqual(response, ["report 3", "report 1", "report 2"])
+
+    def test_sync_dict(self):
+        response = omniture.sync({'slow': FakeQuery(2), 'fast': FakeQuery(1)}, interval=0.01)
+        self.assertEqual(response, {'slow': "report 2", 'fast': "report 1"})
+
+    def test_as_completed(self):
+        """ Reports are yielded as soon as they are ready """
+        queries = [FakeQuery(3), FakeQuery(1)]
+        keys = [key for key, report in omniture.as_completed(queries, interval=0.01)]
+        self.assertEqual(keys, [1, 0])
+
+    def test_errors_are_raised(self):
+        self.assertRaises(omniture.InvalidReportError, omniture.sync, [BrokenQuery(1)], interval=0.01)
+
+    def test_timeout(self):
+        with scheduler.Scheduler(max_workers=1, interval=10) as pool:
+            future = pool.submit(FakeQuery(1))
+            self.assertRaises(scheduler.ReportTimeoutError, future.result, 0.01)
+
+    def test_call(self):
+        with scheduler.Scheduler(max_workers=1) as pool:
+            self.assertEqual(pool.call(lambda a, b: a + b, 1, b=2).result(1), 3)
+
+    def test_async_callback(self):
+        """ Query.async hands the finished report to the callback """
+        reports = []
+        pool = scheduler.Scheduler(max_workers=1, interval=0.01)
+        query = omniture.Query(FakeSuite())
+        query.check = FakeQuery(2).check
+        future = query.async(reports.append, interval=0.01, scheduler=pool)
+        self.assertEqual(future.result(1), "report 2")
+        self.assertEqual(reports, ["report 2"])
+        pool.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import json
+import os
+import shutil
+import tempfile
+import time
+import requests_mock
+
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'},
+                                       {'rsid': 'omniture.mobile', 'site_title': 'Mobile'}]})
+METRICS = json.dumps([{'id': 'pageviews', 'name': 'Page Views'}])
+ELEMENTS = json.dumps([{'id': 'page', 'name': 'Page'}])
+SEGMENTS = json.dumps([{'id': 's1', 'name': 'Mobile Visitors'}])
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        omniture.cache.default_metadata_cache().clear()
+        self.path = tempfile.mkdtemp()
+        self.mock = requests_mock.Mocker()
+        self.mock.start()
+        self.mock.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        self.mock.post(ENDPOINT + '?method=Report.GetMetrics', text=METRICS)
+        self.mock.post(ENDPOINT + '?method=Report.GetElements', text=ELEMENTS)
+        self.mock.post(ENDPOINT + '?method=Segments.Get', text=SEGMENTS)
+
+    def tearDown(self):
+        self.mock.stop()
+        shutil.rmtree(self.path)
+
+    def test_lazy(self):
+        analytics = omniture.authenticate('username', 'secret', lazy=True)
+        self.assertEqual(self.mock.call_count, 0)
+        self.assertEqual(len(analytics.suites), 2)
+        self.assertEqual(self.mock.call_count, 1)
+
+    def test_prefetch(self):
+        analytics = omniture.authenticate('username', 'secret')
+        analytics.prefetch(['omniture.mobile'])
+        self.assertEqual(self.mock.call_count, 4)
+        suite = analytics.suites['omniture.mobile']
+        self.assertEqual(suite.metrics['pageviews'].title, 'Page Views')
+        self.assertEqual(suite.segments['Mobile Visitors'].id, 's1')
+        self.assertEqual(self.mock.call_count, 4)
+
+    def test_snapshot(self):
+        """ An account loaded from a snapshot doesn't make any requests for metadata """
+        analytics = omniture.authenticate('username', 'secret')
+        analytics.suites[0].metrics
+        path = os.path.join(self.path, 'snapshot.json')
+        analytics.save_snapshot(path)
+        requests = self.mock.call_count
+
+        restored = omniture.authenticate('username', 'secret', snapshot=path)
+        self.assertEqual([suite.id for suite in restored.suites], ['omniture.api-gateway', 'omniture.mobile'])
+        self.assertEqual(restored.suites[0].metrics['pageviews'].title, 'Page Views')
+        self.assertEqual(self.mock.call_count, requests)
+
+    def test_snapshot_outlives_the_cache(self):
+        """ Metadata from a snapshot doesn't expire or get evicted from the metadata cache """
+        analytics = omniture.authenticate('username', 'secret')
+        for suite in analytics.suites:
+            suite.metrics
+        snapshot = analytics.snapshot()
+        requests = self.mock.call_count
+
+        for metadata_cache in [omniture.MetadataCache(max_size=1), omniture.MetadataCache(ttl=0)]:
+            restored = omniture.authenticate('username', 'secret', snapshot=snapshot,
+                                             metadata_cache=metadata_cache)
+            time.sleep(0.01)
+            for suite in restored.suites:
+                self.assertEqual(suite.metrics['pageviews'].title, 'Page Views')
+            for suite in restored.suites:
+                suite.metrics
+        self.assertEqual(self.mock.call_count, requests)
+
+        restored.suites[0].invalidate('metrics')
+        restored.suites[0].metrics
+        self.assertEqual(self.mock.call_count, requests + 1)
+
+    def test_snapshot_version(self):
+        snapshot = omniture.authenticate('username', 'secret').snapshot()
+        snapshot['version'] = 0
+        self.assertRaises(ValueError, omniture.authenticate, 'username', 'secret', snapshot=snapshot)
+
+    def test_metadata_cache(self):
+        """ Metadata expires, can be invalidated and is shared between accounts """
+        metadata_cache = omniture.MetadataCache(ttl=60, max_size=3)
+        analytics = omniture.authenticate('username', 'secret', metadata_cache=metadata_cache)
+        suite = analytics.suites[0]
+        suite.metrics
+        suite.metrics
+        self.assertEqual(self.mock.call_count, 2)
+
+        other = omniture.authenticate('username', 'secret', metadata_cache=metadata_cache)
+        other.suites[0].metrics
+        self.assertEqual(self.mock.call_count, 3)
+
+        suite.invalidate('metrics')
+        suite.metrics
+        self.assertEqual(self.mock.call_count, 4)
+
+        stats = metadata_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations']), (2, 2, 1))
+
+    def test_metadata_cache_expires_by_default(self):
+        """ The shared cache picks up metadata that changed within the hour """
+        metadata_cache = omniture.cache.default_metadata_cache()
+        self.assertEqual(metadata_cache.ttl, 3600)
+        metadata_cache.set('key', 'value')
+        created, value = metadata_cache.entries['key']
+        metadata_cache.entries['key'] = (created - 3601, value)
+        self.assertIsNone(metadata_cache.get('key'))
+
+    def test_metadata_cache_bounds(self):
+        metadata_cache = omniture.MetadataCache(ttl=0, max_size=2)
+        for key in ['a', 'b', 'c']:
+            metadata_cache.set(key, key)
+        self.assertEqual(metadata_cache.stats()['evictions'], 1)
+        time.sleep(0.01)
+        self.assertIsNone(metadata_cache.get('b'))
+        self.assertEqual(metadata_cache.stats()['expired'], 1)
+
+    def test_shared_definitions(self):
+        """ Suites with the same metadata share it, and segments are only fetched once """
+        def metrics(request, context):
+            metrics = [{'id': 'pageviews', 'name': 'Page Views'}]
+            if request.json()['reportSuiteID'] == 'omniture.mobile':
+                metrics.append({'id': 'event1', 'name': 'App Launches'})
+            return json.dumps(metrics)
+        self.mock.post(ENDPOINT + '?method=Report.GetMetrics', text=metrics)
+
+        analytics = omniture.authenticate('username', 'secret')
+        gateway, mobile = analytics.suites
+        self.assertIs(gateway.metadata('metrics')[0], mobile.metadata('metrics')[0])
+        self.assertRaises(TypeError, gateway.metadata('metrics')[0].update, {'name': 'Views'})
+        self.assertEqual(mobile.metrics['event1'].title, 'App Launches')
+
+        gateway.segments
+        mobile.segments
+        self.assertEqual(self.mock.call_count, 4)
+        self.assertEqual(analytics.metadata_cache.definitions.stats()['definitions'], 3)
+
+    def test_diff(self):
+        metadata = {'metrics': [{'id': 'pageviews', 'name': 'Page Views'},
+                                {'id': 'visits', 'name': 'Visits'}]}
+        other = {'metrics': [{'id': 'pageviews', 'name': 'Views'},
+                             {'id': 'event1', 'name': 'App Launches'}]}
+        analytics = omniture.authenticate('username', 'secret')
+        gateway = omniture.account.Suite('Gateway', 'gateway', analytics, metadata=metadata)
+        mobile = omniture.account.Suite('Mobile', 'mobile', analytics, metadata=other)
+
+        diff = gateway.diff(mobile, 'metrics')
+        self.assertEqual([metric['id'] for metric in diff.added], ['event1'])
+        self.assertEqual([metric['id'] for metric in diff.removed], ['visits'])
+        self.assertEqual([(old['name'], new['name']) for old, new in diff.changed], [('Page Views', 'Views')])
+        self.assertEqual(gateway.diff(gateway, 'metrics'), ([], [], []))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+import unittest
+import sys
+import omniture
+from omniture import utils
+
+
+class Item(object):
+    def __init__(self, title, id):
+        self.title = title
+        self.id = id
+
+    def __repr__(self):
+        return "<{0}: {1}>".format(self.title, self.id)
+
+
+class AddressableListTest(unittest.TestCase):
+    def setUp(self):
+        self.items = utils.AddressableList([Item('Page Views', 'pageviews'),
+                                            Item('Visits', 'visits'),
+                                            Item('Orders', 'orders')], 'metrics')
+
+    def test_lookup(self):
+        """ Items can be found by position, id and title """
+        self.assertEqual(self.items[0].id, 'pageviews')
+        self.assertEqual(self.items['visits'].title, 'Visits')
+        self.assertEqual(self.items['Orders'].id, 'orders')
+        self.assertEqual([item.id for item in self.items[1:]], ['visits', 'orders'])
+
+    def test_missing(self):
+        self.assertRaises(KeyError, self.items.__getitem__, 'pages')
+
+    def test_ambiguous(self):
+        """ A key that matches several items is an error """
+        self.items.append(Item('visits', 'event1'))
+        self.assertRaises(KeyError, self.items.__getitem__, 'visits')
+        self.assertEqual(self.items['event1'].title, 'visits')
+
+    def test_mutation(self):
+        """ The indexes follow changes to the list """
+        self.assertEqual(self.items['orders'].title, 'Orders')
+        del self.items[0]
+        self.items.insert(0, Item('Revenue', 'revenue'))
+        self.items[1] = Item('Bounces', 'bounces')
+        self.assertEqual(self.items['revenue'], self.items[0])
+        self.assertEqual(self.items['bounces'], self.items[1])
+        self.assertRaises(KeyError, self.items.__getitem__, 'visits')
+        self.items.sort(key=lambda item: item.id)
+        self.assertEqual(self.items['orders'], self.items[1])
+
+
+class ValueTest(unittest.TestCase):
+    def setUp(self):
+        self.raw = {u'id': u'evar1', u'name': u'Caf\xe9 Campaign', u'type': u'string'}
+        self.value = omniture.Element(self.raw['name'], self.raw['id'], None, self.raw)
+
+    def test_attributes_come_from_raw(self):
+        self.assertEqual(self.value.title, 'Caf\xc3\xa9 Campaign')
+        self.assertEqual(self.value.type, 'string')
+        self.assertFalse(hasattr(self.value, 'classification'))
+        self.assertFalse(hasattr(self.value, '__dict__'))
+
+    def test_interned(self):
+        other = omniture.Element(u'Caf\xe9 ' + u'Campaign', 'evar' + '1', None, self.raw)
+        self.assertIs(other.title, self.value.title)
+        self.assertIs(other.id, omniture.Element('x', 'evar1', None).id)
+        self.assertIsInstance(self.value.id, unicode)
+
+    def test_interned_strings_are_released(self):
+        """ Titles aren't kept around once the metadata they belong to is gone """
+        title = ''.join(['Page Views ', str(id(self))])
+        before = sys.getrefcount(title)
+        metadata_cache = omniture.MetadataCache()
+        metadata_cache.set('metrics', omniture.Value.list('metrics', [{'id': 'pageviews', 'title': title}], None))
+        self.assertIs(metadata_cache.get('metrics')[0].title, title)
+        metadata_cache.clear()
+        self.assertEqual(sys.getrefcount(title), before)
+
+    def test_copy(self):
+        element = self.value.range(10)
+        self.assertEqual(element.type, 'string')
+        self.assertEqual(element.serialize(), {'id': 'evar1', 'startingWith': '0', 'top': '10'})
+        self.assertEqual(self.value.serialize(), {'id': 'evar1'})
+
+if __name__ == '__main__':
+    unittest.main()
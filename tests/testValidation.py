@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import json
+import requests_mock
+
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'},
+                                       {'rsid': 'omniture.mobile', 'site_title': 'Mobile'}]})
+METRICS = json.dumps([{'id': 'pageviews', 'name': 'Page Views'}, {'id': 'visits', 'name': 'Visits'}])
+ELEMENTS = json.dumps([{'id': 'page', 'name': 'Page'}, {'id': 'browser', 'name': 'Browser'}])
+SEGMENTS = json.dumps([{'id': 's1', 'name': 'Mobile Visitors'}])
+
+
+class ValidationTest(unittest.TestCase):
+    def setUp(self):
+        omniture.cache.default_metadata_cache().clear()
+        self.mock = requests_mock.Mocker()
+        self.mock.start()
+        self.mock.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        self.mock.post(ENDPOINT + '?method=Report.GetMetrics', text=METRICS)
+        self.mock.post(ENDPOINT + '?method=Report.GetElements', text=ELEMENTS)
+        self.mock.post(ENDPOINT + '?method=Segments.Get', text=SEGMENTS)
+        self.analytics = omniture.authenticate('username', 'secret')
+        self.description = {
+            'reportSuiteID': 'omniture.api-gateway',
+            'dateFrom': '2015-06-01',
+            'dateTo': '2015-06-02',
+            'dateGranularity': 'day',
+            'metrics': [{'id': 'pageviews'}, 'Visits'],
+            'elements': [{'id': 'page', 'top': 10}],
+            'segments': [{'id': 'Mobile Visitors'}],
+            'sortBy': 'visits',
+            'locale': 'en_US',
+        }
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_compile(self):
+        query = self.analytics.suites['omniture.api-gateway'].compile({'reportDescription': self.description})
+        self.assertEqual(query.raw, {
+            'reportSuiteID': 'omniture.api-gateway',
+            'dateFrom': '2015-06-01',
+            'dateTo': '2015-06-02',
+            'dateGranularity': 'day',
+            'metrics': [{'id': 'pageviews'}, {'id': 'visits'}],
+            'elements': [{'id': 'page', 'top': 10}],
+            'segments': [{'id': 's1'}],
+            'sortBy': 'visits',
+            'locale': 'en_US',
+        })
+        self.assertEqual(self.description['elements'], [{'id': 'page', 'top': 10}])
+
+    def test_options(self):
+        """ The other parts of a 1.4 report description are kept as they are """
+        del self.description['segments']
+        self.description.update({'expedite': True, 'validate': False, 'segment_id': 'Mobile Visitors'})
+        raw = self.analytics.suites[0].compile(self.description).raw
+        self.assertEqual(raw['expedite'], True)
+        self.assertEqual(raw['validate'], False)
+        self.assertEqual(raw['segment_id'], 's1')
+
+    def test_errors(self):
+        """ Every problem with a description is reported at once """
+        self.description.update({
+            'metrics': ['pageviews', 'orders'],
+            'elements': ['pages'],
+            'dateGranularity': 'fortnight',
+            'colour': 'blue',
+        })
+        try:
+            self.analytics.suites[0].compile(self.description)
+        except omniture.ValidationError as error:
+            self.assertEqual(len(error.errors), 4)
+            self.assertTrue(error.errors[-1].startswith('elements[0]: Cannot find pages'))
+        else:
+            self.fail("the description should be invalid")
+
+    def test_other_suite(self):
+        self.description['sortBy'] = 'Visitors'
+        try:
+            self.analytics.suites['omniture.mobile'].compile(self.description)
+        except omniture.ValidationError as error:
+            self.assertEqual(error.errors, [
+                "reportSuiteID: the description is for omniture.api-gateway, not omniture.mobile",
+                "sortBy: Cannot find Visitors among the available metrics",
+            ])
+        else:
+            self.fail("the description is for another suite")
+
+    def test_compile_many(self):
+        other = dict(self.description, reportSuiteID='omniture.mobile', metrics=['orders'])
+        missing = dict(self.description, reportSuiteID='omniture.desktop')
+        try:
+            self.analytics.compile({'gateway': self.description, 'mobile': other, 'desktop': missing})
+        except omniture.ValidationError as error:
+            self.assertEqual(sorted(message.split(':')[0] for message in error.errors), ['desktop', 'mobile'])
+        else:
+            self.fail("the descriptions should be invalid")
+
+        requests = self.mock.call_count
+        queries = self.analytics.compile([self.description, json.dumps(self.description)])
+        self.assertEqual([query.raw['metrics'] for query in queries], [[{'id': 'pageviews'}, {'id': 'visits'}]] * 2)
+        self.assertEqual(self.mock.call_count, requests)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+import unittest
+import omniture
+import json
+import os
+import shutil
+import tempfile
+import time
+import requests
+import requests_mock
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+ENDPOINT = 'https://api.omniture.com/admin/1.4/rest/'
+SUITES = json.dumps({'report_suites': [{'rsid': 'omniture.api-gateway', 'site_title': 'Gateway'}]})
+PAGES = 5
+
+
+failing_pages = set()
+dropped_pages = set()
+
+
+def warehouse_page(request, context):
+    """ Serves the pages of a warehouse report, the first pages being the slowest """
+    page = request.json()['page']
+    if page in dropped_pages:
+        raise requests.ConnectionError("Connection dropped")
+    if page in failing_pages:
+        context.status_code = 400
+        return json.dumps({'error': 'server_error', 'error_description': 'Page failed'})
+    if page > PAGES:
+        context.status_code = 400
+        return json.dumps({'error': 'eof_or_invalid_page'})
+    time.sleep(0.01 * (PAGES - page))
+    if request.json()['reportID'] != 123456789:
+        page = page * 100
+    return "page,visits\n{0},{1}\n".format(page, page * 10)
+
+
+def queue_report(request, context):
+    """ Sorted reports get a different report ID """
+    if 'sortBy' in request.json()['reportDescription']:
+        return '{"reportID": 987654321}'
+    return '{"reportID": 123456789}'
+
+
+class WarehouseTest(unittest.TestCase):
+    def setUp(self):
+        self.mock = requests_mock.Mocker()
+        self.mock.start()
+        self.mock.post(ENDPOINT + '?method=Company.GetReportSuites', text=SUITES)
+        self.mock.post(ENDPOINT + '?method=Report.Queue', text=queue_report)
+        self.mock.post(ENDPOINT + '?method=Report.Get', text=warehouse_page)
+        self.analytics = omniture.authenticate('username', 'secret')
+        self.directory = tempfile.mkdtemp()
+        self.query = self.analytics.suites[0].report.source('warehouse')\
+            .element('page', disable_validation=True)\
+            .metric('visits', disable_validation=True)
+
+    def tearDown(self):
+        self.mock.stop()
+        shutil.rmtree(self.directory)
+
+    def test_pages_in_order(self):
+        """ Pages fetched concurrently are put back together in page order """
+        report = self.query.download(workers=3).sync(interval=0)
+        self.assertEqual(list(report.data['page']), [1, 2, 3, 4, 5])
+        self.assertEqual(list(report.data['visits']), [10, 20, 30, 40, 50])
+
+    def test_empty_report(self):
+        """ A report whose first page is already past the end has no rows """
+        self.mock.post(ENDPOINT + '?method=Report.Get', status_code=400,
+                       text=json.dumps({'error': 'eof_or_invalid_page'}))
+        report = self.query.download(workers=3).sync(interval=0)
+        self.assertEqual(len(report.data), 0)
+        self.assertEqual(list(report), [])
+
+    def test_csv_sink(self):
+        """ Pages are appended to the file in order, with a single header """
+        path = os.path.join(self.directory, 'report.csv')
+        report = self.query.download(workers=3, sink=path).sync(interval=0)
+        self.assertEqual(report.data, path)
+        with open(path) as fp:
+            lines = fp.read().splitlines()
+        self.assertEqual(lines, ['page,visits', '1,10', '2,20', '3,30', '4,40', '5,50'])
+        self.assertEqual([row['page'] for row in report], [1, 2, 3, 4, 5])
+        self.assertEqual([len(batch) for batch in report.iter_rows(batch_size=2)], [2, 2, 1])
+
+    def test_callback_sink(self):
+        pages = []
+        report = self.query.download(sink=lambda number, frame: pages.append((number, len(frame)))).sync(interval=0)
+        self.assertEqual(pages, [(1, 1), (2, 1), (3, 1), (4, 1), (5, 1)])
+        self.assertRaises(ValueError, iter, report)
+
+    def test_unverifiable_sinks(self):
+        """ Sinks whose pages can't be checked can't be resumed either """
+        checkpoint = os.path.join(self.directory, 'report.json')
+        for sink in [lambda number, frame: None, os.path.join(self.directory, 'report.parquet')]:
+            self.assertRaises(ValueError, self.query.download, sink=sink, checkpoint=checkpoint)
+            self.assertFalse(omniture.warehouse.build_sink(sink).verify(0, 0, ''))
+
+    @unittest.skipIf(pq is None, "pyarrow isn't installed")
+    def test_parquet_sink(self):
+        """ Pages whose columns come out as other types than the first page's still fit the file """
+        path = os.path.join(self.directory, 'report.parquet')
+        sink = omniture.warehouse.ParquetSink(path)
+        sink.open()
+        sink.write(1, "page,visits,campaign\n1,10,\n")
+        sink.write(2, "page,visits,campaign\n2,2.5,spring\n3,,\n")
+        sink.close()
+        table = pq.read_table(path).to_pandas()
+        self.assertEqual(list(table['page']), [1, 2, 3])
+        self.assertEqual(list(table['visits'][:2]), [10, 2.5])
+        self.assertTrue(table['campaign'].isnull()[0])
+        self.assertEqual(table['campaign'][1], 'spring')
+
+    def test_resume(self):
+        """ An interrupted download picks up after the last page that was written """
+        path = os.path.join(self.directory, 'report.csv')
+        checkpoint = os.path.join(self.directory, 'report.json')
+        query = self.query.download(workers=1, sink=path, checkpoint=checkpoint)
+
+        failing_pages.add(3)
+        try:
+            self.assertRaises(omniture.InvalidReportError, query.sync, interval=0)
+        finally:
+            failing_pages.clear()
+
+        # a new query, as if the process had been restarted
+        requests_before = self.mock.call_count
+        query = self.query.download(workers=1, sink=path, checkpoint=checkpoint)
+        query.sync(interval=0)
+        requests = self.mock.request_history[requests_before:]
+        self.assertTrue(all('Report.Get' in request.url for request in requests), "The report was queued again")
+        self.assertEqual([request.json()['page'] for request in requests], [3, 4, 5, 6])
+        with open(path) as fp:
+            lines = fp.read().splitlines()
+        self.assertEqual(lines, ['page,visits', '1,10', '2,20', '3,30', '4,40', '5,50'])
+
+    def test_parallel_downloads(self):
+        """ Two warehouse reports on the same account don't share their paging """
+        other = self.query.sortBy('visits')
+        first, second = omniture.sync([self.query.download(workers=2), other.download(workers=2)], interval=0)
+        self.assertEqual(list(first.data['page']), [1, 2, 3, 4, 5])
+        self.assertEqual(list(second.data['page']), [100, 200, 300, 400, 500])
+
+    def test_connection_errors(self):
+        """ Dropped connections are only retried by the account's retry policy """
+        analytics = omniture.authenticate('username', 'secret', retry=omniture.RetryPolicy(retries=2, backoff=0))
+        query = analytics.suites[0].report.source('warehouse')\
+            .element('page', disable_validation=True)\
+            .metric('visits', disable_validation=True)\
+            .download(workers=1, retry_interval=0)
+
+        dropped_pages.add(2)
+        try:
+            self.assertRaises(requests.ConnectionError, query.sync, interval=0)
+        finally:
+            dropped_pages.clear()
+        self.assertEqual(analytics.retry.stats()['Report.Get']['retries'], 2)
+
+if __name__ == '__main__':
+    unittest.main()